@@ -1,6 +1,6 @@
 import os
-import time
-from flask import Flask, render_template, request
+import json
+from flask import Flask, Response, jsonify, render_template, request, stream_with_context
 
 # ================== APP ==================
 app = Flask(__name__)
@@ -9,10 +9,50 @@ app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB uploads
 # ================== MODULE IMPORTS ==================
 from modules.background import replace_wall
 from modules.flooring import replace_floor
+from modules.room import restyle_room
 from modules.product_color import product_color
 from modules.multicolor import detect_multicolors, modify_detected_color
 from modules.object_change import replace_accessory
-from modules.product_replace import analyze_image, replace_product
+from modules.product_replace import (
+    analyze_image, replace_product, collect_replacements, iter_replace_product
+)
+from modules.jobs import job_queue, snapshot_request, QueueFullError, DONE, FAILED
+from modules.result_cache import result_cache
+from modules import metrics
+from modules import common_sam
+from modules.storage import output_storage, tmp_storage, safe_prefix as storage_safe
+from modules import janitor
+from modules import catalog
+from modules.ai_clients import client_stats
+from modules.seg_pool import seg_pool, SegmentationBusyError
+from modules.texture_map import InvalidTilesAcrossError
+
+# Output keys -> URLs (local /static/output/... or S3)
+app.jinja_env.globals["media_url"] = output_storage.url
+
+
+@app.before_request
+def start_background_tasks():
+    janitor.ensure_running()
+
+
+# Segmentation capacity exhausted: tell the client to retry instead of
+# letting requests pile up behind the pool
+@app.errorhandler(SegmentationBusyError)
+@app.errorhandler(common_sam.PredictorPoolTimeout)
+def segmentation_busy(e):
+    return jsonify(error=str(e)), 503, {"Retry-After": "5"}
+
+
+@app.errorhandler(InvalidTilesAcrossError)
+def invalid_tiles_across(e):
+    return jsonify(error=str(e)), 400
+
+
+# Segmentation models load lazily on first use. PRELOAD_MODELS=1 loads
+# them here instead (in the gunicorn master when preload_app is on).
+if os.getenv("PRELOAD_MODELS", "0") == "1":
+    common_sam.warmup()
 
 
 # ====================================================
@@ -45,6 +85,17 @@ def flooring():
     return render_template("flooring.html", output=output)
 
 
+# ====================================================
+# 🏡 ROOM RESTYLE (WALL + FLOOR, SINGLE PASS)
+# ====================================================
+@app.route("/room", methods=["GET", "POST"])
+def room():
+    output = None
+    if request.method == "POST":
+        output = restyle_room(request)
+    return render_template("room.html", output=output)
+
+
 # ====================================================
 # 🎨 PRODUCT COLOR
 # ====================================================
@@ -66,17 +117,19 @@ def product_color_view():
 # ====================================================
 @app.route("/multi-color", methods=["GET", "POST"])
 def multi_color():
-    detected_color_list = None
+    detected_colors = None
     multicolor_filename = None
+    analysis_key = None
     ts = None
 
     if request.method == "POST":
-        detected_color_list, multicolor_filename, ts = detect_multicolors(request)
+        detected_colors, multicolor_filename, analysis_key, ts = detect_multicolors(request)
 
     return render_template(
         "multicolor.html",
-        detected_color_list=detected_color_list,
+        detected_colors=detected_colors,
         multicolor_filename=multicolor_filename,
+        analysis_key=analysis_key,
         ts=ts
     )
 
@@ -146,6 +199,172 @@ def product_replace_action():
     )
 
 
+# ====================================================
+# 🛏️ PRODUCT REPLACE – STEP 2 (STREAMING, SSE)
+# ====================================================
+@app.route("/product-replace/stream", methods=["POST"])
+def product_replace_stream():
+    # Uploads are read here, while the request is still open
+    setup_path, replacements = collect_replacements(request)
+
+    def events():
+        try:
+            # Keep the setup image from the janitor while the chain runs
+            with tmp_storage.pinned(setup_path):
+                for event in iter_replace_product(setup_path, replacements):
+                    if event.get("key"):
+                        event["url"] = output_storage.url(event["key"])
+                    yield f"event: {event['event']}\ndata: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"[ERROR] product replace stream failed: {e}")
+            yield f"event: error\ndata: {json.dumps({'event': 'error', 'message': str(e)})}\n\n"
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ====================================================
+# ⏳ ASYNC JOBS (SUBMIT + POLL / STREAM)
+# ====================================================
+JOB_HANDLERS = {
+    "background": replace_wall,
+    "flooring": replace_floor,
+    "room": restyle_room,
+    "product-color": product_color,
+    "multi-color": detect_multicolors,
+    "modify-detected-color": modify_detected_color,
+    "object-change": replace_accessory,
+    "product-replace/analyze": analyze_image,
+    "product-replace/replace": replace_product,
+}
+
+
+@app.route("/jobs/<path:kind>", methods=["POST"])
+def submit_job(kind):
+    handler = JOB_HANDLERS.get(kind)
+    if handler is None:
+        return jsonify(error=f"Unknown job kind: {kind}"), 404
+
+    try:
+        job = job_queue.submit(kind, handler, snapshot_request(request))
+    except QueueFullError as e:
+        return jsonify(error=str(e)), 503
+
+    return jsonify(
+        job_id=job.id,
+        status=job.status,
+        status_url=f"/jobs/{job.id}",
+        stream_url=f"/jobs/{job.id}/stream"
+    ), 202
+
+
+@app.route("/jobs/<job_id>", methods=["GET"])
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found"), 404
+    return jsonify(job.to_dict())
+
+
+@app.route("/jobs/<job_id>/stream", methods=["GET"])
+def job_stream(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Job not found"), 404
+
+    def events():
+        version = -1
+        while True:
+            if job.version != version:
+                version = job.version
+                yield f"data: {json.dumps(job.to_dict())}\n\n"
+                if job.status in (DONE, FAILED):
+                    return
+            else:
+                yield ": keep-alive\n\n"
+            job_queue.wait_for_change(job, version)
+
+    return Response(events(), mimetype="text/event-stream")
+
+
+# ====================================================
+# 🗂️ CATALOG BATCH (PRODUCT COLOR × MANY SKUS)
+# ====================================================
+@app.route("/catalog", methods=["POST"])
+def catalog_job():
+    """
+    JSON body:
+      {"input": "<dir or manifest under CATALOG_INPUT_ROOT>",
+       "colors": [...] | "all", "color_target": "product",
+       "job_name": optional (re-use to resume)}
+    """
+    body = request.get_json(force=True, silent=True) or {}
+
+    try:
+        items = catalog.load_items(
+            catalog.resolve_input(body.get("input", "")),
+            root=catalog.CATALOG_INPUT_ROOT
+        )
+    except (OSError, ValueError, KeyError) as e:
+        return jsonify(error=f"Invalid catalog input: {e}"), 400
+
+    colors = body.get("colors")
+    if colors == "all":
+        colors = list(catalog.COLOR_FABRIC_MAP)
+    try:
+        colors = catalog.validate_colors(colors)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    color_target = body.get("color_target", "product")
+
+    if not items:
+        return jsonify(error="Catalog needs at least one image"), 400
+
+    job_name = body.get("job_name") or catalog.default_job_name(items, colors, color_target)
+    out_dir = os.path.join(catalog.CATALOG_DIR, storage_safe(job_name))
+
+    try:
+        job = job_queue.submit(
+            "catalog", catalog.run_catalog,
+            items, colors, color_target, out_dir,
+            with_progress=True
+        )
+    except QueueFullError as e:
+        return jsonify(error=str(e)), 503
+
+    return jsonify(
+        job_id=job.id,
+        job_dir=out_dir,
+        status_url=f"/jobs/{job.id}",
+        stream_url=f"/jobs/{job.id}/stream"
+    ), 202
+
+
+# ====================================================
+# 📊 METRICS
+# ====================================================
+@app.route("/metrics", methods=["GET"])
+def metrics_view():
+    return jsonify(
+        **metrics.snapshot(),
+        result_cache=result_cache.stats(),
+        sam_embedding_cache=common_sam.embedding_cache.stats(),
+        segmentation_models_loaded=common_sam.models_loaded(),
+        jobs=job_queue.stats(),
+        segmentation_pool=seg_pool.stats(),
+        ai_clients=client_stats()
+    )
+
+
+@app.route("/warmup", methods=["POST"])
+def warmup_view():
+    common_sam.warmup()
+    return jsonify(status="ready")
+
+
 # ====================================================
 # 🚀 RUN (RENDER SAFE)
 # ====================================================
@@ -0,0 +1,133 @@
+"""
+bench_batching.py
+---------------------------------
+Closed-loop load test of the DINO / SAM-encoder micro-batchers.
+
+For each max batch size, `clients` threads (default = batch size) send
+images back to back through a MicroBatcher wrapping the real model
+forward. Reports per-request p50/p99 latency and overall images/sec.
+The SAM embedding cache is bypassed, every request is a real encode.
+
+    python benchmarks/bench_batching.py --model sam --batch-sizes 1-8
+    python benchmarks/bench_batching.py --model dino --requests 16 --wait-ms 20
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_sizes(spec: str):
+    if "-" in spec:
+        lo, hi = spec.split("-")
+        return list(range(int(lo), int(hi) + 1))
+    return [int(s) for s in spec.split(",")]
+
+
+def percentile(values, q):
+    values = sorted(values)
+    idx = min(len(values) - 1, max(0, round(q / 100 * (len(values) - 1))))
+    return values[idx]
+
+
+def make_images(n, side, paths):
+    import cv2
+    import numpy as np
+    from modules.common_sam import make_proxy
+
+    if paths:
+        images = []
+        for p in paths:
+            img = cv2.imread(p)
+            if img is None:
+                raise SystemExit(f"Could not read {p}")
+            images.append(make_proxy(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), side))
+        return [images[i % len(images)] for i in range(n)]
+
+    rng = np.random.default_rng(0)
+    return [rng.integers(0, 256, (side * 3 // 4, side, 3), dtype=np.uint8) for _ in range(n)]
+
+
+def run_level(batcher, make_item, images, clients, per_client):
+    latencies = []
+    lock = threading.Lock()
+
+    def client(c):
+        for r in range(per_client):
+            item = make_item(images[(c * per_client + r) % len(images)])
+            t0 = time.perf_counter()
+            batcher(item)
+            dt = time.perf_counter() - t0
+            with lock:
+                latencies.append(dt)
+
+    threads = [threading.Thread(target=client, args=(c,)) for c in range(clients)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - t0
+
+    return {
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "images_per_s": len(latencies) / wall,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", choices=("sam", "dino"), default="sam")
+    parser.add_argument("--batch-sizes", default="1-8")
+    parser.add_argument("--wait-ms", type=float, default=10)
+    parser.add_argument("--clients", type=int, default=0, help="0 = same as batch size")
+    parser.add_argument("--requests", type=int, default=8, help="per client")
+    parser.add_argument("--side", type=int, default=1024)
+    parser.add_argument("--caption", default="wall")
+    parser.add_argument("--images", nargs="*", help="real photos instead of noise")
+    parser.add_argument("--json", action="store_true")
+    args = parser.parse_args()
+
+    from modules import common_sam
+    from modules.batching import MicroBatcher
+
+    if args.model == "sam":
+        forward = common_sam.sam_encode
+        make_item = lambda img: img
+    else:
+        forward = common_sam.dino_forward
+        make_item = lambda img: (common_sam.dino_tensor(img), args.caption, 0.3, 0.25)
+
+    sizes = parse_sizes(args.batch_sizes)
+    images = make_images(max(sizes) * args.requests, args.side, args.images)
+
+    # Load weights + first-call overhead outside the measurement
+    forward([make_item(images[0])])
+
+    rows = []
+    for b in sizes:
+        batcher = MicroBatcher(f"bench_{args.model}_{b}", forward, b, args.wait_ms)
+        clients = args.clients or b
+        r = run_level(batcher, make_item, images, clients, args.requests)
+        r.update(batch=b, clients=clients)
+        rows.append(r)
+        if not args.json:
+            if b == sizes[0]:
+                print(f"{args.model}, {args.side}px, wait {args.wait_ms:g} ms, "
+                      f"{args.requests} requests/client")
+                print(f"{'batch':>5}{'clients':>9}{'p50 ms':>10}{'p99 ms':>10}{'img/s':>9}")
+            print(f"{b:>5}{clients:>9}{r['p50_ms']:>10.0f}{r['p99_ms']:>10.0f}"
+                  f"{r['images_per_s']:>9.2f}")
+
+    if args.json:
+        print(json.dumps(rows, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""
+bench_composite.py
+---------------------------------
+Peak RSS + time of the old float64 blend vs modules.compositing.
+
+Each variant runs in its own subprocess so ru_maxrss is not shared.
+Reported "peak" is the extra RSS the blend needed on top of its inputs.
+
+    python benchmarks/bench_composite.py --width 6000 --height 4000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VARIANTS = ("float64", "fixed", "tiled")
+
+
+def _max_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return rss / 1024 if sys.platform != "darwin" else rss / (1024 * 1024)
+
+
+def run_child(variant, width, height, ksize, tile_rows):
+    import cv2
+    import numpy as np
+    from modules.compositing import blend_texture
+
+    rng = np.random.default_rng(0)
+    image_bgr = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    tex = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    mask = np.zeros((height, width), dtype=bool)
+    mask[height // 4: 3 * height // 4, width // 4: 3 * width // 4] = True
+
+    before = _max_rss_mb()
+    t0 = time.perf_counter()
+
+    if variant == "float64":
+        alpha = cv2.GaussianBlur(mask.astype(float), (ksize, ksize), 0)[..., None]
+        blended = (tex * alpha + image_bgr * (1 - alpha)).astype(np.uint8)
+    elif variant == "fixed":
+        blended = blend_texture(image_bgr, tex, mask, ksize, out=image_bgr, tile_rows=0)
+    else:
+        blended = blend_texture(image_bgr, tex, mask, ksize, out=image_bgr, tile_rows=tile_rows)
+
+    elapsed = time.perf_counter() - t0
+    print(json.dumps({
+        "variant": variant,
+        "seconds": elapsed,
+        "peak_extra_mb": _max_rss_mb() - before,
+        "checksum": int(blended[::97, ::89].sum()),
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--width", type=int, default=6000)
+    parser.add_argument("--height", type=int, default=4000)
+    parser.add_argument("--ksize", type=int, default=21)
+    parser.add_argument("--tile-rows", type=int, default=256)
+    parser.add_argument("--child", choices=VARIANTS)
+    args = parser.parse_args()
+
+    if args.child:
+        run_child(args.child, args.width, args.height, args.ksize, args.tile_rows)
+        return
+
+    print(f"{args.width}x{args.height} ({args.width * args.height / 1e6:.1f} MP), ksize={args.ksize}")
+    print(f"{'variant':<10}{'time (s)':>10}{'peak RSS +MB':>16}")
+    for variant in VARIANTS:
+        out = subprocess.run(
+            [sys.executable, __file__, "--child", variant,
+             "--width", str(args.width), "--height", str(args.height),
+             "--ksize", str(args.ksize), "--tile-rows", str(args.tile_rows)],
+            check=True, capture_output=True, text=True
+        )
+        r = json.loads(out.stdout.strip().splitlines()[-1])
+        print(f"{r['variant']:<10}{r['seconds']:>10.2f}{r['peak_extra_mb']:>16.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+"""
+gunicorn.conf.py
+---------------------------------
+Picked up automatically by `gunicorn app:app`.
+
+PRELOAD_MODELS=1   load GroundingDINO + SAM in the master before forking,
+                   so workers share the weights copy-on-write
+WARMUP_ON_START=1  (without preload) each worker loads the models in a
+                   background thread right after fork instead of on the
+                   first segmentation request
+"""
+
+import os
+import threading
+
+preload_app = os.getenv("PRELOAD_MODELS", "0") == "1"
+
+
+def post_fork(server, worker):
+    if preload_app or os.getenv("WARMUP_ON_START", "0") != "1":
+        return
+
+    from modules.common_sam import warmup
+    threading.Thread(target=warmup, name="sam-warmup", daemon=True).start()
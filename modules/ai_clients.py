@@ -7,12 +7,23 @@ Centralized AI client initialization for:
 
 This file MUST be imported by other modules.
 DO NOT initialize clients elsewhere.
+
+Every model call goes through a resilience layer:
+- token-bucket rate limiting per model
+- jittered exponential backoff on 429 / 5xx / connection errors
+- circuit breaker per model (fail fast while the upstream is down)
+- per-call deadline covering all retries
 """
 
 import os
+import time
+import random
+import threading
+import importlib.util
 from dotenv import load_dotenv
-from openai import OpenAI
+from openai import OpenAI, DefaultHttpxClient
 import google.generativeai as genai
+from modules import metrics
 
 # =========================================================
 # 🔹 LOAD ENV VARIABLES (.env for local, Render env for prod)
@@ -29,23 +40,394 @@ if not OPENAI_API_KEY:
 if not GEMINI_API_KEY:
     raise RuntimeError("❌ GEMINI_API_KEY is not set")
 
+# =========================================================
+# 🔹 RESILIENCE CONFIG
+# =========================================================
+
+AI_MAX_RETRIES = int(os.getenv("AI_MAX_RETRIES", "4"))
+AI_BACKOFF_BASE = float(os.getenv("AI_BACKOFF_BASE", "1.0"))       # seconds
+AI_BACKOFF_MAX = float(os.getenv("AI_BACKOFF_MAX", "30"))          # seconds
+AI_DEADLINE_SECONDS = float(os.getenv("AI_DEADLINE_SECONDS", "180"))
+AI_BREAKER_FAILURES = int(os.getenv("AI_BREAKER_FAILURES", "5"))
+AI_BREAKER_RESET_SECONDS = float(os.getenv("AI_BREAKER_RESET_SECONDS", "30"))
+
+GEMINI_RATE_PER_MIN = float(os.getenv("GEMINI_RATE_PER_MIN", "60"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "10"))
+OPENAI_RATE_PER_MIN = float(os.getenv("OPENAI_RATE_PER_MIN", "300"))
+OPENAI_BURST = int(os.getenv("OPENAI_BURST", "20"))
+
+RETRYABLE_STATUS = {408, 429, 500, 502, 503, 504}
+
+
+class AIClientError(RuntimeError):
+    """Base class for resilience-layer failures."""
+
+
+class CircuitOpenError(AIClientError):
+    """Upstream marked down; call rejected without trying."""
+
+
+class DeadlineExceededError(AIClientError):
+    """The per-call deadline ran out (including retries / rate limiting)."""
+
+
+# =========================================================
+# 🔹 TOKEN BUCKET
+# =========================================================
+
+class TokenBucket:
+    def __init__(self, rate_per_min: float, burst: int):
+        self.rate = rate_per_min / 60.0  # tokens per second (0 = unlimited)
+        self.capacity = max(1, burst)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, deadline_at: float):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+
+            if now + wait > deadline_at:
+                raise DeadlineExceededError("Deadline exceeded waiting for rate limit")
+            time.sleep(wait)
+
+
+# =========================================================
+# 🔹 CIRCUIT BREAKER
+# =========================================================
+
+class CircuitBreaker:
+    """
+    closed -> open after `failures` consecutive retryable failures;
+    open -> half-open after `reset_seconds` (one trial call);
+    trial success closes it, trial failure re-opens it.
+    """
+
+    def __init__(self, name: str, failures: int, reset_seconds: float):
+        self.name = name
+        self.failure_threshold = failures
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_seconds:
+            return "half-open"
+        return "open"
+
+    def before_call(self) -> bool:
+        """
+        Raise CircuitOpenError, or return True if this call is the
+        half-open trial.
+        """
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return False
+            if state == "half-open" and not self.trial_in_flight:
+                self.trial_in_flight = True
+                return True
+        metrics.incr(f"ai.circuit_rejected.{self.name}")
+        raise CircuitOpenError(f"{self.name} circuit open, upstream unavailable")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.trial_in_flight or self.failures >= self.failure_threshold:
+                if self.opened_at is None or self.trial_in_flight:
+                    metrics.incr(f"ai.circuit_opened.{self.name}")
+                    print(f"[WARN] {self.name} circuit opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+            self.trial_in_flight = False
+
+    def abort_trial(self):
+        # trial never reached the upstream; let the next call try
+        with self._lock:
+            self.trial_in_flight = False
+
+
+# =========================================================
+# 🔹 RETRY POLICY
+# =========================================================
+
+def status_of(exc):
+    for attr in ("status_code", "code"):
+        value = getattr(exc, attr, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    return getattr(response, "status_code", None)
+
+
+def is_retryable(exc) -> bool:
+    status = status_of(exc)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    # connection resets, read timeouts (openai / httpx / requests / grpc)
+    name = type(exc).__name__
+    return isinstance(exc, (ConnectionError, TimeoutError)) or any(
+        key in name for key in ("Connection", "Timeout", "Unavailable", "DeadlineExceeded")
+    )
+
+
+def backoff_delay(attempt: int) -> float:
+    """
+    Full jitter: uniform(0, min(max, base * 2^attempt)).
+    """
+    return random.uniform(0, min(AI_BACKOFF_MAX, AI_BACKOFF_BASE * (2 ** attempt)))
+
+
+class ResilientCaller:
+    """
+    Rate limiter + breaker + retry loop for one model.
+    fn(timeout) is called with the seconds left before the deadline.
+    """
+
+    def __init__(self, name: str, rate_per_min: float, burst: int):
+        self.name = name
+        self.bucket = TokenBucket(rate_per_min, burst)
+        self.breaker = CircuitBreaker(name, AI_BREAKER_FAILURES, AI_BREAKER_RESET_SECONDS)
+
+    def call(self, fn, deadline: float = None):
+        deadline = deadline or AI_DEADLINE_SECONDS
+        deadline_at = time.monotonic() + deadline
+        attempt = 0
+
+        while True:
+            is_trial = self.breaker.before_call()
+            try:
+                self.bucket.acquire(deadline_at)
+            except DeadlineExceededError:
+                if is_trial:
+                    self.breaker.abort_trial()
+                raise
+
+            remaining = deadline_at - time.monotonic()
+            t0 = time.monotonic()
+            try:
+                result = fn(remaining)
+            except Exception as e:
+                retryable = is_retryable(e)
+                if not retryable:
+                    # upstream answered (e.g. 400), so it is not down
+                    self.breaker.record_success()
+                    metrics.incr(f"ai.errors.{self.name}")
+                    raise
+
+                self.breaker.record_failure()
+                metrics.incr(f"ai.retryable_errors.{self.name}")
+
+                delay = backoff_delay(attempt)
+                attempt += 1
+                if attempt > AI_MAX_RETRIES:
+                    raise
+                if time.monotonic() + delay >= deadline_at:
+                    raise DeadlineExceededError(
+                        f"{self.name}: deadline exceeded after {attempt} attempts ({e})"
+                    ) from e
+
+                print(f"[WARN] {self.name} call failed ({e}), retry {attempt}/{AI_MAX_RETRIES} in {delay:.1f}s")
+                metrics.incr(f"ai.retries.{self.name}")
+                time.sleep(delay)
+                continue
+
+            self.breaker.record_success()
+            # the one place per-model call latency is measured
+            metrics.observe(f"ai.latency.{self.name}", time.monotonic() - t0)
+            return result
+
+    def stats(self):
+        return {
+            "circuit": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+        }
+
+
+# =========================================================
+# 🔹 RESILIENT WRAPPERS
+# =========================================================
+
+_callers = {}
+_callers_lock = threading.Lock()
+
+
+def get_caller(name: str, rate_per_min: float, burst: int) -> ResilientCaller:
+    """
+    One caller (bucket + breaker) per model name, shared process-wide.
+    """
+    with _callers_lock:
+        if name not in _callers:
+            _callers[name] = ResilientCaller(name, rate_per_min, burst)
+        return _callers[name]
+
+
+class ResilientGeminiModel:
+    """
+    Drop-in for genai.GenerativeModel.generate_content with resilience.
+    Pass deadline=<seconds> to override AI_DEADLINE_SECONDS.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.caller = get_caller(model.model_name, GEMINI_RATE_PER_MIN, GEMINI_BURST)
+
+    @property
+    def model_name(self):
+        return self.model.model_name
+
+    def generate_content(self, contents, *, deadline: float = None, **kwargs):
+        request_options = dict(kwargs.pop("request_options", None) or {})
+        per_call_timeout = request_options.get("timeout")
+
+        def attempt(remaining):
+            timeout = remaining if per_call_timeout is None else min(per_call_timeout, remaining)
+            return self.model.generate_content(
+                contents,
+                request_options={**request_options, "timeout": timeout},
+                **kwargs
+            )
+
+        return self.caller.call(attempt, deadline)
+
+
+def resilient_gemini(model) -> ResilientGeminiModel:
+    return ResilientGeminiModel(model)
+
+
+def openai_chat(*, deadline: float = None, **kwargs):
+    """
+    openai_client.chat.completions.create(**kwargs) with resilience.
+    """
+    model = kwargs.get("model", "openai")
+    caller = get_caller(f"openai/{model}", OPENAI_RATE_PER_MIN, OPENAI_BURST)
+    per_call_timeout = kwargs.pop("timeout", None)
+
+    def attempt(remaining):
+        timeout = remaining if per_call_timeout is None else min(per_call_timeout, remaining)
+        # retries are ours, not the SDK's
+        return openai_client.with_options(max_retries=0).chat.completions.create(
+            timeout=timeout, **kwargs
+        )
+
+    return caller.call(attempt, deadline)
+
+
+def client_stats():
+    with _callers_lock:
+        return {name: caller.stats() for name, caller in _callers.items()}
+
+
+# =========================================================
+# 🔹 CONNECTION POOLING
+# =========================================================
+
+# Max pooled (keep-alive) connections per upstream
+AI_POOL_SIZE = int(os.getenv("AI_POOL_SIZE", "32"))
+AI_KEEPALIVE_SECONDS = float(os.getenv("AI_KEEPALIVE_SECONDS", "60"))
+# "grpc": one HTTP/2 channel, calls multiplexed (library default)
+# "rest": HTTP/1.1 keep-alive pool of AI_POOL_SIZE connections
+GEMINI_TRANSPORT = os.getenv("GEMINI_TRANSPORT", "grpc")
+# HTTP/2 for OpenAI needs the optional `h2` package
+OPENAI_HTTP2 = os.getenv("OPENAI_HTTP2", "1") == "1"
+
+
+def _openai_http_client():
+    try:
+        import httpx
+    except ImportError:
+        return None
+
+    http2 = OPENAI_HTTP2 and importlib.util.find_spec("h2") is not None
+    return DefaultHttpxClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=AI_POOL_SIZE,
+            max_keepalive_connections=AI_POOL_SIZE,
+            keepalive_expiry=AI_KEEPALIVE_SECONDS
+        )
+    )
+
+
+def _size_gemini_rest_pool():
+    """
+    The REST transport uses one requests.Session for every model; give
+    it a keep-alive pool big enough for our concurrency.
+    """
+    from requests.adapters import HTTPAdapter
+    from google.generativeai import client as genai_client
+
+    try:
+        session = genai_client.get_default_generative_client()._transport._session
+    except AttributeError:
+        print("[WARN] Could not size Gemini REST connection pool")
+        return
+    adapter = HTTPAdapter(pool_connections=AI_POOL_SIZE, pool_maxsize=AI_POOL_SIZE)
+    session.mount("https://", adapter)
+
+
 # =========================================================
 # 🔹 OPENAI CLIENT (GPT-4o / GPT-4o-mini)
 # =========================================================
 
 openai_client = OpenAI(
-    api_key=OPENAI_API_KEY
+    api_key=OPENAI_API_KEY,
+    http_client=_openai_http_client()
 )
 
 # =========================================================
-# 🔹 GEMINI CLIENT (IMAGE MODEL)
+# 🔹 GEMINI CLIENT (SINGLE SHARED, POOLED)
 # =========================================================
 
-genai.configure(api_key=GEMINI_API_KEY)
+# Configured exactly once; every GenerativeModel shares the default
+# client (and therefore its channel / connection pool).
+genai.configure(api_key=GEMINI_API_KEY, transport=GEMINI_TRANSPORT)
 
-GEMINI_IMAGE = genai.GenerativeModel(
-    model_name="models/gemini-2.5-flash-image"
-)
+if GEMINI_TRANSPORT == "rest":
+    _size_gemini_rest_pool()
+
+_gemini_models = {}
+
+
+def get_gemini_model(model_name: str) -> ResilientGeminiModel:
+    """
+    Shared resilient model per name ("gemini-x" and "models/gemini-x"
+    are the same model). Rate limits, breaker and latency metrics are
+    accounted per model here.
+    """
+    if not model_name.startswith("models/"):
+        model_name = f"models/{model_name}"
+    with _callers_lock:
+        model = _gemini_models.get(model_name)
+    if model is None:
+        model = resilient_gemini(genai.GenerativeModel(model_name=model_name))
+        with _callers_lock:
+            model = _gemini_models.setdefault(model_name, model)
+    return model
+
+
+GEMINI_IMAGE = get_gemini_model("models/gemini-2.5-flash-image")
 
 # =========================================================
 # 🔹 OPTIONAL: SIMPLE HEALTH CHECK
@@ -1,88 +1,59 @@
-import os
 import time
-import cv2
-import numpy as np
-import torch
-from PIL import Image
-import google.generativeai as genai
-from groundingdino.util.inference import predict, load_image
-from modules.common_sam import dino_model, sam_predictor
-
-OUTPUT_DIR = "static/output"
-
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-gemini_model = genai.GenerativeModel("models/gemini-2.5-flash-image")
+from modules.ai_clients import GEMINI_IMAGE
+from modules.seg_pool import seg_pool
+from modules.storage import output_storage
+from modules.image_io import decode_upload, encode_image, save_debug
+from modules.texture_map import parse_tiles_across
+from modules.seam_quality import resolve_mode, should_refine, record_refine
+from modules.payloads import prepare
 
 
 def replace_wall(request):
-    ts = int(time.time())
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    temp_path = os.path.join(OUTPUT_DIR, f"temp_{ts}.jpg")
-    request.files["target_image"].save(temp_path)
-
-    image_rgb, image_tensor = load_image(temp_path)
-    h, w, _ = image_rgb.shape
-    image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
-
-    boxes, _, _ = predict(
-        model=dino_model,
-        image=image_tensor,
+    image_bgr = decode_upload(request.files["target_image"])
+    wall_tex = decode_upload(request.files["wall_image"])
+    tiles_across = parse_tiles_across(request.form.get("tiles_across"))
+
+    # DINO + SAM + tiled texture mapping + blend run in the
+    # segmentation pool (or inline)
+    blended, seam = seg_pool.segment_blend(
+        image_bgr, wall_tex,
         caption="wall",
         box_threshold=0.32,
         text_threshold=0.25,
-        device="cpu"
+        ksize=21,
+        surface="wall",
+        tiles_across=tiles_across
     )
 
-    if len(boxes) == 0:
+    if blended is None:
         raise RuntimeError("No wall detected")
 
-    box = boxes[0] * torch.tensor([w, h, w, h])
-    x_c, y_c, bw, bh = box.tolist()
-
-    input_box = np.array([
-        int(x_c - bw / 2),
-        int(y_c - bh / 2),
-        int(x_c + bw / 2),
-        int(y_c + bh / 2)
-    ])
-
-    sam_predictor.set_image(image_rgb)
-    mask = sam_predictor.predict(box=input_box, multimask_output=False)[0][0]
-
-    wall_tex = cv2.imdecode(
-        np.frombuffer(request.files["wall_image"].read(), np.uint8),
-        cv2.IMREAD_COLOR
-    )
-    wall_tex = cv2.resize(wall_tex, (w, h))
+    save_debug("sam_wall", blended)
 
-    alpha = cv2.GaussianBlur(mask.astype(float), (21, 21), 0)[..., None]
-    blended = (wall_tex * alpha + image_bgr * (1 - alpha)).astype(np.uint8)
+    # Gemini seam cleanup only when the local composite needs it
+    mode = resolve_mode(request.form.get("refine"))
+    if not should_refine("wall", mode, seam):
+        return output_storage.save(encode_image(blended, ".png"), "final_wall", ".png")
 
-    sam_out = os.path.join(OUTPUT_DIR, f"sam_wall_{ts}.png")
-    cv2.imwrite(sam_out, blended)
+    blended_payload = prepare(blended, "lossless")
+    t0 = time.time()
 
-    response = gemini_model.generate_content([
+    response = GEMINI_IMAGE.generate_content([
         {
             "role": "user",
             "parts": [
                 {"text": "Remove highlight line, seamless wall transition."},
                 {
-                    "inline_data": {
-                        "mime_type": "image/png",
-                        "data": open(sam_out, "rb").read()
-                    }
+                    "inline_data": blended_payload
                 }
             ]
         }
     ])
+    record_refine("wall", time.time() - t0)
 
     for c in response.candidates:
         for p in c.content.parts:
             if p.inline_data:
-                final_path = os.path.join(OUTPUT_DIR, f"final_wall_{ts}.png")
-                with open(final_path, "wb") as f:
-                    f.write(p.inline_data.data)
-                return os.path.basename(final_path)
+                return output_storage.save(p.inline_data.data, "final_wall", ".png")
 
     raise RuntimeError("Gemini failed")
@@ -0,0 +1,97 @@
+"""
+batching.py
+---------------------------------
+Cross-request micro-batching for CPU inference.
+
+Request threads submit one item and block on a Future. A single worker
+thread per model takes the first waiting item, keeps collecting until
+max_batch items are queued or max_wait_ms has passed since the first
+one, runs run_batch(items) as one forward pass and scatters the results
+back to the callers.
+
+With max_batch=1 nothing is queued: submit() runs the item inline.
+"""
+
+import time
+import queue
+import threading
+from concurrent.futures import Future
+from modules.metrics import incr, observe
+
+
+class MicroBatcher:
+    def __init__(self, name: str, run_batch, max_batch: int, max_wait_ms: float):
+        """
+        run_batch(list_of_items) -> list_of_results (same order / length).
+        """
+        self.name = name
+        self.run_batch = run_batch
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max(0.0, max_wait_ms) / 1000.0
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._loop, name=f"batch-{self.name}", daemon=True
+                )
+                self._thread.start()
+
+    def submit(self, item) -> Future:
+        if self.max_batch == 1:
+            fut = Future()
+            try:
+                fut.set_result(self.run_batch([item])[0])
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+
+        self._ensure_worker()
+        fut = Future()
+        self._queue.put((item, fut, time.time()))
+        return fut
+
+    def __call__(self, item):
+        return self.submit(item).result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _loop(self):
+        while True:
+            batch = self._collect()
+            items = [b[0] for b in batch]
+            t0 = time.time()
+
+            for _, _, queued_at in batch:
+                observe(f"batch.{self.name}.queue_wait", t0 - queued_at)
+
+            try:
+                results = self.run_batch(items)
+            except Exception as e:
+                print(f"[ERROR] {self.name} batch of {len(items)} failed: {e}")
+                for _, fut, _ in batch:
+                    fut.set_exception(e)
+                continue
+
+            observe(f"batch.{self.name}.forward", time.time() - t0)
+            incr(f"batch.{self.name}.batches")
+            incr(f"batch.{self.name}.items", len(items))
+
+            for (_, fut, _), result in zip(batch, results):
+                fut.set_result(result)
@@ -0,0 +1,325 @@
+"""
+catalog.py
+---------------------------------
+Batch product_color over a whole catalog (SKUs x fabrics).
+
+- Input: a directory of product photos (SKU = file stem) or a manifest
+  (.json list of {"sku", "image"} or .csv with sku,image columns)
+- Bounded concurrency + rate limiting of the Gemini calls
+- Images are written into the job dir (images/<sku>-<hash>/<color>.png), not
+  static/output, so neither the result cache nor the janitor can delete
+  them while the job or its manifest still refers to them
+- Resumable: every finished (sku, color) pair is appended to
+  checkpoint.jsonl; a re-run with the same job dir skips the pairs whose
+  image is still on disk
+- Writes results.json (the results manifest) at the end
+- Reports throughput (images/min) while running
+
+CLI:
+    python -m modules.catalog --input catalog/ --colors "Sage Green,Oatmeal"
+    python -m modules.catalog --input skus.csv --all-colors --out cache/catalog/spring
+"""
+
+import os
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
+from io import BytesIO
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image
+from modules.product_color import (
+    COLOR_FABRIC_MAP, PRODUCT_COLOR_CALL_TIMEOUT, render_color
+)
+from modules.result_cache import content_hash
+from modules.storage import LocalBackend, output_storage, safe_prefix
+from modules.ai_clients import TokenBucket
+from modules.payloads import prepare
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CATALOG_DIR = os.getenv("CATALOG_DIR", os.path.join(BASE_DIR, "cache", "catalog"))
+# API requests may only read inputs below this directory
+CATALOG_INPUT_ROOT = os.getenv("CATALOG_INPUT_ROOT", os.path.join(BASE_DIR, "catalog_input"))
+CATALOG_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", "4"))
+CATALOG_RATE_PER_MIN = float(os.getenv("CATALOG_RATE_PER_MIN", "60"))  # 0 = unlimited
+CATALOG_REPORT_SECONDS = float(os.getenv("CATALOG_REPORT_SECONDS", "10"))
+
+IMAGE_EXTS = (".jpg", ".jpeg", ".png", ".webp")
+
+
+# =========================================================
+# 🔹 INPUT
+# =========================================================
+def load_items(path: str, root: str = None):
+    """
+    Directory or manifest -> [{"sku", "image"}, ...] (image paths absolute).
+    With root set (API requests), every image must resolve below it.
+    """
+    path = os.path.abspath(path)
+
+    if os.path.isdir(path):
+        items = [
+            {"sku": os.path.splitext(name)[0], "image": os.path.join(path, name)}
+            for name in sorted(os.listdir(path))
+            if name.lower().endswith(IMAGE_EXTS)
+        ]
+    else:
+        base = os.path.dirname(path)
+
+        if path.lower().endswith(".json"):
+            with open(path, "r", encoding="utf-8") as f:
+                rows = json.load(f)
+        elif path.lower().endswith(".csv"):
+            with open(path, "r", encoding="utf-8", newline="") as f:
+                rows = list(csv.DictReader(f))
+        else:
+            raise ValueError(f"Unsupported catalog input: {path}")
+
+        items = [
+            {"sku": str(row["sku"]), "image": os.path.join(base, row["image"])}
+            for row in rows
+        ]
+
+    # Absolute or ../ rows (and symlinks) must not escape the input root
+    if root is not None:
+        for item in items:
+            item["image"] = resolve_input(item["image"], root)
+    return items
+
+
+def default_job_name(items, colors, color_target) -> str:
+    """
+    Same inputs -> same job dir, so re-submitting resumes automatically.
+    """
+    payload = json.dumps([items, colors, color_target], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:16]
+
+
+# =========================================================
+# 🔹 CHECKPOINT
+# =========================================================
+def load_checkpoint(path: str, job_dir: str):
+    """
+    (sku, color) -> record for pairs whose image still exists in job_dir.
+    """
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue  # torn last line after a crash
+            if not os.path.isfile(os.path.join(job_dir, rec["filename"])):
+                continue  # image gone (or an old static/output key): redo
+            done[(rec["sku"], rec["color"])] = rec
+    return done
+
+
+def image_key(sku: str, color: str) -> str:
+    # Hash suffix: SKUs that differ only in unsafe characters stay apart
+    sku_id = hashlib.sha256(sku.encode("utf-8")).hexdigest()[:8]
+    return f"images/{safe_prefix(sku)}-{sku_id}/{safe_prefix(color)}.png"
+
+
+# =========================================================
+# 🔹 RUN
+# =========================================================
+def run_catalog(items, colors, color_target="product", out_dir=None,
+                concurrency=CATALOG_CONCURRENCY,
+                rate_per_min=CATALOG_RATE_PER_MIN,
+                on_progress=None):
+    """
+    Recolor every item in every color. Returns the results manifest.
+    """
+    unknown = [c for c in colors if c not in COLOR_FABRIC_MAP]
+    if unknown:
+        raise ValueError(f"Unsupported colors: {', '.join(unknown)}")
+
+    out_dir = out_dir or os.path.join(
+        CATALOG_DIR, default_job_name(items, colors, color_target)
+    )
+    os.makedirs(out_dir, exist_ok=True)
+    checkpoint_path = os.path.join(out_dir, "checkpoint.jsonl")
+    manifest_path = os.path.join(out_dir, "results.json")
+
+    done = load_checkpoint(checkpoint_path, out_dir)
+    job_files = LocalBackend(out_dir, "/")
+    pending = [
+        (item, color)
+        for item in items
+        for color in colors
+        if (item["sku"], color) not in done
+    ]
+    total = len(items) * len(colors)
+
+    print(f"🔹 Catalog job {out_dir}: {total} pairs, {len(done)} already done, {len(pending)} to run")
+
+    # Job-level budget, on top of the per-model limits in ai_clients
+    limiter = TokenBucket(rate_per_min, burst=1)
+    ckpt_lock = threading.Lock()
+    failed = []
+    started = time.time()
+    last_report = [started]
+    completed = [0]
+
+    @lru_cache(maxsize=max(2, concurrency * 2))
+    def load_product(image_path):
+        with open(image_path, "rb") as f:
+            data = f.read()
+        # Encoded once per SKU for the life of the job, not per color
+        payload = prepare(Image.open(BytesIO(data)), "edit")
+        return payload, content_hash(data)
+
+    def report(force=False):
+        now = time.time()
+        if not force and now - last_report[0] < CATALOG_REPORT_SECONDS:
+            return
+        last_report[0] = now
+        elapsed = max(now - started, 1e-6)
+        progress = {
+            "total": total,
+            "done": len(done),
+            "failed": len(failed),
+            "pending": total - len(done) - len(failed),
+            "images_per_min": round(completed[0] / elapsed * 60, 2),
+            "elapsed_s": round(elapsed, 1),
+        }
+        print(
+            f"🔹 Catalog {progress['done']}/{total} done, {progress['failed']} failed, "
+            f"{progress['images_per_min']} images/min"
+        )
+        if on_progress:
+            on_progress(progress)
+
+    def task(item, color):
+        payload, digest = load_product(item["image"])
+        limiter.acquire(deadline_at=float("inf"))
+        result = render_color(
+            payload, color, color_target, int(time.time()),
+            timeout=PRODUCT_COLOR_CALL_TIMEOUT, image_digest=digest
+        )
+        if not result:
+            return None
+        # Copy out of static/output (possibly a cache hit) into the job dir
+        key = image_key(item["sku"], color)
+        job_files.write(key, output_storage.read(result["filename"]))
+        return key
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency),
+                            thread_name_prefix="catalog") as pool:
+        futures = {
+            pool.submit(task, item, color): (item, color)
+            for item, color in pending
+        }
+
+        for future in as_completed(futures):
+            item, color = futures[future]
+            try:
+                result = future.result()
+                error = None if result else "no image returned"
+            except Exception as e:
+                result, error = None, str(e)
+
+            if result:
+                # filename is relative to the job dir
+                rec = {"sku": item["sku"], "color": color, "filename": result}
+                with ckpt_lock:
+                    with open(checkpoint_path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(rec) + "\n")
+                    done[(item["sku"], color)] = rec
+                    completed[0] += 1
+            else:
+                print(f"[ERROR] Catalog {item['sku']} / {color}: {error}")
+                failed.append({"sku": item["sku"], "color": color, "error": error})
+
+            report()
+
+    report(force=True)
+
+    manifest = {
+        "color_target": color_target,
+        "colors": colors,
+        "total": total,
+        "started": started,
+        "finished": time.time(),
+        "images_per_min": round(completed[0] / max(time.time() - started, 1e-6) * 60, 2),
+        "results": [
+            done[(item["sku"], color)]
+            for item in items
+            for color in colors
+            if (item["sku"], color) in done
+        ],
+        "failed": failed,
+        "job_dir": out_dir,
+    }
+
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, manifest_path)
+
+    return manifest
+
+
+def resolve_input(path: str, root: str = CATALOG_INPUT_ROOT) -> str:
+    """
+    API-side input path (relative to root, or absolute): must resolve,
+    symlinks included, to somewhere under root.
+    """
+    real_root = os.path.realpath(root)
+    full = os.path.realpath(os.path.join(real_root, path))
+    if os.path.commonpath([real_root, full]) != real_root:
+        raise ValueError(f"Catalog input must be under {root}: {path}")
+    return full
+
+
+def validate_colors(colors):
+    """API-side colors: a non-empty list of COLOR_FABRIC_MAP names."""
+    if not isinstance(colors, list) or not colors or \
+            not all(isinstance(c, str) for c in colors):
+        raise ValueError('colors must be a non-empty list of color names or "all"')
+    unknown = [c for c in colors if c not in COLOR_FABRIC_MAP]
+    if unknown:
+        raise ValueError(f"Unsupported colors: {', '.join(unknown)}")
+    return colors
+
+
+# =========================================================
+# 🔹 CLI
+# =========================================================
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Recolor a product catalog.")
+    parser.add_argument("--input", required=True, help="image directory or .json/.csv manifest")
+    parser.add_argument("--colors", default="", help="comma-separated color names")
+    parser.add_argument("--all-colors", action="store_true")
+    parser.add_argument("--target", default="product", choices=["product", "lace"])
+    parser.add_argument("--out", default=None, help="job dir (re-use to resume)")
+    parser.add_argument("--concurrency", type=int, default=CATALOG_CONCURRENCY)
+    parser.add_argument("--rate", type=float, default=CATALOG_RATE_PER_MIN, help="calls per minute, 0 = unlimited")
+    args = parser.parse_args(argv)
+
+    colors = list(COLOR_FABRIC_MAP) if args.all_colors else [
+        c.strip() for c in args.colors.split(",") if c.strip()
+    ]
+    if not colors:
+        parser.error("give --colors or --all-colors")
+
+    manifest = run_catalog(
+        load_items(args.input), colors, args.target, args.out,
+        concurrency=args.concurrency, rate_per_min=args.rate
+    )
+    print(f"✅ {len(manifest['results'])}/{manifest['total']} done, "
+          f"{len(manifest['failed'])} failed -> {os.path.join(manifest['job_dir'], 'results.json')}")
+    return 0 if not manifest["failed"] else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
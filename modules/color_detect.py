@@ -0,0 +1,264 @@
+"""
+color_detect.py
+---------------------------------
+Local product color detection (no LLM call).
+
+  1. Segment the product with DINO + SAM on the bounded-size proxy
+     (falls back to the whole frame if nothing is detected).
+  2. k-means in Lab space on a sample of the masked pixels, with
+     lightness down-weighted so shading doesn't split one fabric into
+     several colors.
+  3. Name each cluster center through a precomputed RGB -> name LUT,
+     merge clusters that land on the same name.
+
+The result carries per-color pixel fractions and a label map (one label
+per named color, 255 = not product) so modify_detected_color can reuse
+the masks instead of re-segmenting.
+"""
+
+import os
+import json
+import time
+import cv2
+import numpy as np
+from modules.common_sam import (
+    checkout_predictor, set_image_cached, make_proxy, detect,
+    box_to_xyxy, predict_mask
+)
+from modules.storage import output_storage
+from modules.metrics import incr, observe
+
+MULTICOLOR_CAPTION = os.getenv("MULTICOLOR_CAPTION", "product")
+MULTICOLOR_USE_SAM = os.getenv("MULTICOLOR_USE_SAM", "1") == "1"
+MULTICOLOR_K = int(os.getenv("MULTICOLOR_K", "6"))
+MULTICOLOR_SAMPLE = int(os.getenv("MULTICOLOR_SAMPLE", "20000"))
+MULTICOLOR_MIN_FRACTION = float(os.getenv("MULTICOLOR_MIN_FRACTION", "0.03"))
+MULTICOLOR_L_WEIGHT = float(os.getenv("MULTICOLOR_L_WEIGHT", "0.5"))
+
+BOX_THRESHOLD = 0.30
+TEXT_THRESHOLD = 0.25
+BACKGROUND_LABEL = 255
+
+# =========================================================
+# 🎨 NAMED COLOR LUT
+# =========================================================
+NAMED_COLORS = {
+    "Black": (20, 20, 20),
+    "Charcoal": (54, 69, 79),
+    "Gray": (128, 128, 128),
+    "Silver": (192, 192, 192),
+    "White": (245, 245, 245),
+    "Ivory": (255, 250, 235),
+    "Cream": (240, 230, 200),
+    "Beige": (215, 195, 160),
+    "Tan": (200, 160, 110),
+    "Brown": (120, 75, 40),
+    "Chocolate": (75, 45, 25),
+    "Red": (200, 30, 30),
+    "Maroon": (110, 20, 35),
+    "Pink": (240, 150, 180),
+    "Rose": (200, 100, 120),
+    "Orange": (240, 130, 30),
+    "Rust": (170, 75, 35),
+    "Yellow": (245, 210, 40),
+    "Mustard": (200, 160, 40),
+    "Gold": (210, 170, 60),
+    "Olive": (110, 110, 40),
+    "Green": (40, 150, 60),
+    "Sage Green": (150, 170, 130),
+    "Dark Green": (25, 80, 40),
+    "Teal": (0, 120, 120),
+    "Turquoise": (60, 200, 200),
+    "Sky Blue": (130, 190, 235),
+    "Blue": (40, 90, 200),
+    "Navy": (25, 35, 80),
+    "Purple": (110, 50, 140),
+    "Lavender": (180, 160, 220),
+    "Magenta": (200, 40, 150),
+}
+
+LUT_BITS = 5  # 32 levels per channel -> 32768 entries
+
+
+def to_lab(rgb_u8):
+    """(..., 3) uint8 RGB -> float32 Lab (L 0-100, a/b signed)."""
+    flat = rgb_u8.reshape(-1, 1, 3).astype(np.float32) / 255.0
+    return cv2.cvtColor(flat, cv2.COLOR_RGB2LAB).reshape(rgb_u8.shape)
+
+
+def _build_lut():
+    names = list(NAMED_COLORS)
+    palette = to_lab(np.array(list(NAMED_COLORS.values()), np.uint8))
+
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    axis = np.arange(levels, dtype=np.uint16) * step + step // 2
+    grid = np.stack(np.meshgrid(axis, axis, axis, indexing="ij"), -1).astype(np.uint8)
+    lab = to_lab(grid).reshape(-1, 1, 3)
+
+    dist = ((lab - palette[None]) ** 2).sum(-1)
+    lut = dist.argmin(1).astype(np.uint8).reshape(levels, levels, levels)
+    return names, lut
+
+
+COLOR_NAMES, COLOR_LUT = _build_lut()
+
+
+def name_color(rgb) -> str:
+    r, g, b = (int(c) >> (8 - LUT_BITS) for c in rgb)
+    return COLOR_NAMES[COLOR_LUT[r, g, b]]
+
+
+# =========================================================
+# 🧩 SEGMENT + CLUSTER
+# =========================================================
+def product_mask(proxy_rgb):
+    """Bool product mask at proxy resolution, or None."""
+    if not MULTICOLOR_USE_SAM:
+        return None
+
+    ph, pw = proxy_rgb.shape[:2]
+    boxes, _, _ = detect(proxy_rgb, MULTICOLOR_CAPTION, BOX_THRESHOLD, TEXT_THRESHOLD)
+    if len(boxes) == 0:
+        return None
+
+    with checkout_predictor() as predictor:
+        set_image_cached(predictor, proxy_rgb)
+        mask = predict_mask(predictor, box_to_xyxy(boxes[0], pw, ph), (ph, pw))
+    return mask if mask.any() else None
+
+
+def cluster_colors(pixels_rgb, k: int = MULTICOLOR_K):
+    """
+    k-means in weighted Lab on a sample of (N, 3) uint8 pixels.
+    Returns (centers_lab (k, 3), sample_labels) - centers are unweighted.
+    """
+    rng = np.random.default_rng(0)
+    if len(pixels_rgb) > MULTICOLOR_SAMPLE:
+        pixels_rgb = pixels_rgb[rng.choice(len(pixels_rgb), MULTICOLOR_SAMPLE, replace=False)]
+
+    lab = to_lab(pixels_rgb)
+    weights = np.array([MULTICOLOR_L_WEIGHT, 1.0, 1.0], np.float32)
+    k = max(1, min(k, len(lab)))
+
+    cv2.setRNGSeed(0)
+    criteria = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 20, 0.5)
+    _, labels, centers = cv2.kmeans(
+        lab * weights, k, None, criteria, 2, cv2.KMEANS_PP_CENTERS
+    )
+    return centers / weights, labels.ravel()
+
+
+def assign_labels(image_lab, centers_lab):
+    """Nearest center per pixel in weighted Lab -> (H, W) int labels."""
+    weights = np.array([MULTICOLOR_L_WEIGHT, 1.0, 1.0], np.float32)
+    flat = image_lab.reshape(-1, 3) * weights
+    c = (centers_lab * weights).astype(np.float32)
+
+    # |x - c|^2 = |x|^2 - 2 x.c + |c|^2 ; |x|^2 is constant per pixel
+    score = flat @ c.T * -2 + (c ** 2).sum(1)
+    return score.argmin(1).reshape(image_lab.shape[:2])
+
+
+def detect_colors(image_rgb):
+    """
+    Returns (colors, label_map):
+      colors:    [{"name", "fraction", "rgb", "label"}], largest first
+      label_map: uint8 (h, w) at proxy resolution, 255 = not product
+    """
+    t0 = time.time()
+    proxy = make_proxy(image_rgb)
+
+    mask = product_mask(proxy)
+    if mask is None:
+        incr("multicolor.no_product_mask")
+        mask = np.ones(proxy.shape[:2], bool)
+
+    pixels = proxy[mask]
+    centers_lab, _ = cluster_colors(pixels)
+    cluster_of = assign_labels(to_lab(proxy), centers_lab)
+
+    # Name clusters, merge same-named ones
+    centers_rgb = cv2.cvtColor(
+        centers_lab.reshape(-1, 1, 3).astype(np.float32), cv2.COLOR_LAB2RGB
+    ).reshape(-1, 3)
+    centers_rgb = np.clip(centers_rgb * 255, 0, 255).round().astype(np.uint8)
+
+    counts = np.bincount(cluster_of[mask], minlength=len(centers_lab))
+    total = max(int(counts.sum()), 1)
+
+    groups = {}
+    for idx, rgb in enumerate(centers_rgb):
+        if counts[idx] == 0:
+            continue
+        groups.setdefault(name_color(rgb), []).append(idx)
+
+    colors = []
+    for name, members in groups.items():
+        n = int(counts[members].sum())
+        if n / total < MULTICOLOR_MIN_FRACTION:
+            continue
+        rgb = (centers_rgb[members] * counts[members, None]).sum(0) / n
+        colors.append({
+            "name": name,
+            "fraction": round(n / total, 4),
+            "rgb": [int(v) for v in rgb.round()],
+            "members": members,
+        })
+    colors.sort(key=lambda c: -c["fraction"])
+
+    remap = np.full(len(centers_lab), BACKGROUND_LABEL, np.uint8)
+    for label, c in enumerate(colors):
+        remap[c.pop("members")] = label
+        c["label"] = label
+
+    label_map = remap[cluster_of]
+    label_map[~mask] = BACKGROUND_LABEL
+
+    observe("multicolor.detect_local", time.time() - t0)
+    return colors, label_map
+
+
+# =========================================================
+# 💾 PERSIST FOR STEP 2
+# =========================================================
+def save_analysis(colors, label_map) -> str:
+    """Store the label map + color table; returns the analysis key."""
+    ok, png = cv2.imencode(".png", label_map)
+    if not ok:
+        raise RuntimeError("Failed to encode label map")
+    labels_key = output_storage.save(png.tobytes(), "multicolor_labels", ".png")
+
+    doc = {"labels": labels_key, "colors": colors}
+    return output_storage.save(json.dumps(doc).encode(), "multicolor_colors", ".json")
+
+
+def load_analysis(analysis_key: str):
+    """analysis key -> (colors, label_map) or None if it was swept."""
+    if not analysis_key or not output_storage.exists(analysis_key):
+        return None
+
+    doc = json.loads(output_storage.read(analysis_key))
+    if not output_storage.exists(doc["labels"]):
+        return None
+
+    buf = np.frombuffer(output_storage.read(doc["labels"]), np.uint8)
+    return doc["colors"], cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE)
+
+
+def color_mask(colors, label_map, name: str, out_hw, grow: int = 0):
+    """
+    Bool mask of one named color, resized to out_hw and dilated by grow
+    px (the label map is proxy-sized, so its edges are coarse); None if
+    the color is not in the analysis.
+    """
+    label = next((c["label"] for c in colors if c["name"] == name), None)
+    if label is None:
+        return None
+    mask = (label_map == label).astype(np.uint8)
+    h, w = out_hw
+    mask = cv2.resize(mask, (w, h), interpolation=cv2.INTER_NEAREST)
+    if grow > 0:
+        k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (2 * grow + 1, 2 * grow + 1))
+        mask = cv2.dilate(mask, k)
+    return mask.astype(bool)
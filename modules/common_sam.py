@@ -1,10 +1,29 @@
 import os
+import time
+import queue
+import hashlib
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
 import torch
 import requests
 import importlib.resources as pkg_resources
+from PIL import Image
 
-from groundingdino.util.inference import load_model
+import groundingdino.datasets.transforms as T
+from groundingdino.util.inference import load_model, predict, preprocess_caption
+from groundingdino.util.utils import get_phrases_from_posmap
 from segment_anything import sam_model_registry, SamPredictor
+from segment_anything.utils.transforms import ResizeLongestSide
+from modules.sam_backend import (
+    configure_threads, optimize_dino, optimize_sam, backend_name,
+    TORCH_NUM_THREADS, TracedImageEncoder
+)
+from modules.metrics import incr, gauge, observe
+from modules.batching import MicroBatcher
 
 # =========================================================
 # FORCE CPU (Render-safe)
@@ -78,23 +97,555 @@ def download_if_missing(path: str, url: str, min_size_mb: int):
     print(f"✅ Downloaded {os.path.basename(path)}")
 
 # =========================================================
-# ENSURE MODEL FILES
+# LAZY MODEL HANDLES (CPU ONLY, THREAD-SAFE)
+# =========================================================
+# Nothing is downloaded or loaded at import time. The first segmentation
+# request (or an explicit warmup()) loads the weights once per process;
+# with PRELOAD_MODELS=1 + gunicorn preload_app they are loaded in the
+# master and shared copy-on-write by forked workers.
+_model_lock = threading.Lock()
+_dino_model = None
+_sam_model = None
+_sam_predictor = None
+_sam_pool = None
+# Set by limit_threads() in segmentation pool workers
+_thread_limit = 0
+
+
+def get_dino_model():
+    global _dino_model
+    if _dino_model is None:
+        with _model_lock:
+            if _dino_model is None:
+                download_if_missing(DINO_CHECKPOINT, DINO_URL, min_size_mb=600)
+                configure_threads(_thread_limit or TORCH_NUM_THREADS)
+                print(f"🔹 Loading GroundingDINO (CPU, {backend_name()})")
+                _dino_model = optimize_dino(load_model(
+                    DINO_CONFIG,
+                    DINO_CHECKPOINT,
+                    device="cpu"
+                ))
+    return _dino_model
+
+
+def get_sam_model():
+    global _sam_model
+    if _sam_model is None:
+        with _model_lock:
+            if _sam_model is None:
+                download_if_missing(SAM_CHECKPOINT, SAM_URL, min_size_mb=300)
+                configure_threads(_thread_limit or TORCH_NUM_THREADS)
+                print(f"🔹 Loading SAM (CPU, {backend_name()})")
+                sam = sam_model_registry["vit_b"](checkpoint=SAM_CHECKPOINT)
+                sam.to(device)
+                _sam_model = optimize_sam(sam)
+    return _sam_model
+
+
 # =========================================================
-download_if_missing(DINO_CHECKPOINT, DINO_URL, min_size_mb=600)
-download_if_missing(SAM_CHECKPOINT, SAM_URL, min_size_mb=300)
+# SAM PREDICTOR POOL (SHARED WEIGHTS, BOUNDED CHECKOUT)
+# =========================================================
+# SamPredictor keeps per-image state (features, sizes) on the instance,
+# so one shared predictor lets concurrent requests overwrite each other's
+# embedding between set_image() and predict(). The pool hands each
+# request its own predictor; all of them wrap the same SAM model, so the
+# weights exist once per process. The torch intra-op thread budget is
+# split across the instances so N parallel encodes don't oversubscribe.
+SAM_POOL_SIZE = max(1, int(os.getenv("SAM_POOL_SIZE", "2")))
+SAM_POOL_TIMEOUT = float(os.getenv("SAM_POOL_TIMEOUT", "120"))
+
+
+class PredictorPoolTimeout(RuntimeError):
+    pass
+
+
+class SamPredictorPool:
+    def __init__(self, sam, size: int = SAM_POOL_SIZE):
+        self.size = size
+        self._idle = queue.LifoQueue()
+        for _ in range(size):
+            self._idle.put(SamPredictor(sam))
+
+    @contextmanager
+    def checkout(self, timeout: float = SAM_POOL_TIMEOUT):
+        """
+        Borrow a predictor for one image. Blocks while all instances are
+        busy; raises PredictorPoolTimeout after `timeout` seconds.
+        """
+        t0 = time.time()
+        try:
+            predictor = self._idle.get(timeout=timeout)
+        except queue.Empty:
+            incr("sam_pool.timeouts")
+            raise PredictorPoolTimeout(
+                f"No SAM predictor free after {timeout:g}s ({self.size} in pool)"
+            )
+        observe("sam_pool.wait", time.time() - t0)
+        gauge("sam_pool.in_use", self.in_use())
+
+        try:
+            yield predictor
+        finally:
+            self._idle.put(predictor)
+            gauge("sam_pool.in_use", self.in_use())
+
+    def in_use(self) -> int:
+        return self.size - self._idle.qsize()
+
+
+def thread_budget() -> int:
+    if _thread_limit > 0:
+        return _thread_limit
+    return TORCH_NUM_THREADS if TORCH_NUM_THREADS > 0 else (os.cpu_count() or 1)
+
+
+def limit_threads(threads: int):
+    """
+    Cap this process at `threads` torch threads and a single predictor
+    (segmentation pool workers: one task at a time, N processes share the
+    machine). Call before the models load; the loaders and get_sam_pool()
+    keep to it instead of the process-wide TORCH_NUM_THREADS / cpu_count.
+    """
+    global _thread_limit, SAM_POOL_SIZE
+    _thread_limit = max(1, threads)
+    SAM_POOL_SIZE = 1
+    configure_threads(_thread_limit)
+
+
+def get_sam_pool():
+    global _sam_pool
+    if _sam_pool is None:
+        sam = get_sam_model()
+        with _model_lock:
+            if _sam_pool is None:
+                per_instance = max(1, thread_budget() // SAM_POOL_SIZE)
+                configure_threads(per_instance)
+                print(f"🔹 SAM predictor pool: {SAM_POOL_SIZE} x {per_instance} threads")
+                _sam_pool = SamPredictorPool(sam, SAM_POOL_SIZE)
+    return _sam_pool
+
+
+def checkout_predictor(timeout: float = SAM_POOL_TIMEOUT):
+    """
+    with checkout_predictor() as predictor:
+        set_image_cached(predictor, image)
+        mask = predict_mask(predictor, box, out_hw)
+    """
+    return get_sam_pool().checkout(timeout)
+
+
+def get_sam_predictor():
+    """
+    Standalone predictor (not pooled). Only safe when a single thread
+    uses it; request handlers should use checkout_predictor().
+    """
+    global _sam_predictor
+    if _sam_predictor is None:
+        sam = get_sam_model()
+        with _model_lock:
+            if _sam_predictor is None:
+                _sam_predictor = SamPredictor(sam)
+    return _sam_predictor
+
+
+def models_loaded() -> bool:
+    return _dino_model is not None and _sam_model is not None
+
+
+def warmup():
+    """
+    Load GroundingDINO + SAM now instead of on first request.
+    """
+    t0 = time.time()
+    get_dino_model()
+    get_sam_pool()
+    print(f"✅ Segmentation models ready in {time.time() - t0:.1f}s")
+
 
 # =========================================================
-# LOAD MODELS (CPU ONLY)
+# SAM EMBEDDING CACHE (MEMORY + DISK, LRU, BYTE BUDGETS)
 # =========================================================
-print("🔹 Loading GroundingDINO (CPU)")
-dino_model = load_model(
-    DINO_CONFIG,
-    DINO_CHECKPOINT,
-    device="cpu"
+# set_image() runs the full ViT-B encoder. A wall pass followed by a
+# floor pass on the same photo re-encodes identical pixels, so the image
+# embedding is cached by content hash and replayed into the predictor.
+EMBED_CACHE_DIR = os.getenv(
+    "SAM_EMBED_CACHE_DIR",
+    os.path.join(BASE_DIR, "cache", "sam_embeddings")
+)
+EMBED_CACHE_MEM_MB = int(os.getenv("SAM_EMBED_CACHE_MEM_MB", "256"))
+EMBED_CACHE_DISK_MB = int(os.getenv("SAM_EMBED_CACHE_DISK_MB", "2048"))
+
+
+def image_hash(image_rgb) -> str:
+    """
+    Content hash of an RGB uint8 array (shape and inference backend are
+    part of the key, since int8/traced encoders give different embeddings).
+    """
+    h = hashlib.sha256()
+    h.update(backend_name().encode())
+    h.update(str(image_rgb.shape).encode())
+    h.update(image_rgb.tobytes())
+    return h.hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two-tier LRU cache of SAM image embeddings.
+    - memory: OrderedDict bounded by mem_bytes
+    - disk:   one .pt file per key bounded by disk_bytes (LRU by mtime)
+    A budget of 0 disables that tier.
+    """
+
+    def __init__(self, cache_dir: str, mem_bytes: int, disk_bytes: int):
+        self.cache_dir = cache_dir
+        self.mem_bytes = mem_bytes
+        self.disk_bytes = disk_bytes
+        self._mem = OrderedDict()
+        self._mem_used = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        if self.disk_bytes > 0:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    # ---------------- helpers ----------------
+    @staticmethod
+    def _entry_bytes(entry) -> int:
+        features = entry["features"]
+        return features.element_size() * features.nelement()
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.pt")
+
+    def _mem_put(self, key: str, entry):
+        size = self._entry_bytes(entry)
+        if size > self.mem_bytes:
+            return
+
+        with self._lock:
+            if key in self._mem:
+                self._mem.move_to_end(key)
+                return
+            self._mem[key] = entry
+            self._mem_used += size
+            while self._mem_used > self.mem_bytes and self._mem:
+                _, old = self._mem.popitem(last=False)
+                self._mem_used -= self._entry_bytes(old)
+
+    def _disk_put(self, key: str, entry):
+        path = self._disk_path(key)
+        if os.path.exists(path):
+            return
+
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        torch.save(entry, tmp_path)
+        os.replace(tmp_path, path)
+        self._disk_evict()
+
+    def _disk_evict(self):
+        files = []
+        total = 0
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith(".pt"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            files.append((st.st_mtime, st.st_size, path))
+            total += st.st_size
+
+        files.sort()
+        for _, size, path in files:
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    # ---------------- public API ----------------
+    def get(self, key: str):
+        if self.mem_bytes > 0:
+            with self._lock:
+                entry = self._mem.get(key)
+                if entry is not None:
+                    self._mem.move_to_end(key)
+                    self.hits += 1
+                    return entry
+
+        if self.disk_bytes > 0:
+            path = self._disk_path(key)
+            if os.path.exists(path):
+                try:
+                    entry = torch.load(path, map_location=device)
+                except Exception as e:
+                    print(f"[WARN] Dropping unreadable SAM cache entry {path}: {e}")
+                    os.remove(path)
+                else:
+                    os.utime(path)  # touch for LRU
+                    self._mem_put(key, entry)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return entry
+
+        self.misses += 1
+        return None
+
+    def put(self, key: str, entry):
+        if self.mem_bytes > 0:
+            self._mem_put(key, entry)
+        if self.disk_bytes > 0:
+            try:
+                self._disk_put(key, entry)
+            except OSError as e:
+                print(f"[WARN] Could not persist SAM embedding: {e}")
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "mem_entries": len(self._mem),
+            "mem_bytes": self._mem_used,
+        }
+
+
+embedding_cache = EmbeddingCache(
+    EMBED_CACHE_DIR,
+    mem_bytes=EMBED_CACHE_MEM_MB * 1024 * 1024,
+    disk_bytes=EMBED_CACHE_DISK_MB * 1024 * 1024
 )
 
-print("🔹 Loading SAM (CPU)")
-sam = sam_model_registry["vit_b"](checkpoint=SAM_CHECKPOINT)
-sam.to(device)
 
-sam_predictor = SamPredictor(sam)
+def set_image_cached(predictor, image_rgb):
+    """
+    Drop-in replacement for predictor.set_image(image_rgb).
+    On a cache miss the image goes through the (micro-batched) SAM
+    encoder; either way the embedding is loaded straight into the
+    predictor.
+    """
+    key = image_hash(image_rgb)
+    entry = embedding_cache.get(key)
+
+    if entry is None:
+        t0 = time.time()
+        entry = sam_encoder(image_rgb)
+        print(f"🔹 SAM encode {time.time() - t0:.2f}s (cache miss)")
+        embedding_cache.put(key, entry)
+
+    predictor.reset_image()
+    predictor.features = entry["features"]
+    predictor.original_size = tuple(entry["original_size"])
+    predictor.input_size = tuple(entry["input_size"])
+    predictor.is_image_set = True
+    return key
+
+
+# =========================================================
+# PROXY SEGMENTATION (BOUNDED SIZE IN, FULL-RES MASK OUT)
+# =========================================================
+# DINO + SAM run on a proxy whose long side is at most SEGMENT_MAX_SIDE.
+# Only the final SAM logits are upsampled to the original resolution,
+# so latency and memory no longer scale with the camera resolution.
+SEGMENT_MAX_SIDE = int(os.getenv("SEGMENT_MAX_SIDE", "1024"))
+
+# Same preprocessing as groundingdino.util.inference.load_image
+_dino_transform = T.Compose([
+    T.RandomResize([800], max_size=1333),
+    T.ToTensor(),
+    T.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
+])
+
+
+def make_proxy(image_rgb, max_side: int = SEGMENT_MAX_SIDE):
+    """
+    Downscale so the long side is <= max_side (no-op if already smaller).
+    """
+    h, w = image_rgb.shape[:2]
+    scale = max_side / max(h, w)
+    if max_side <= 0 or scale >= 1:
+        return image_rgb
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(image_rgb, size, interpolation=cv2.INTER_AREA)
+
+
+def dino_tensor(image_rgb):
+    """
+    GroundingDINO input tensor built straight from an RGB array.
+    """
+    image_tensor, _ = _dino_transform(Image.fromarray(image_rgb), None)
+    return image_tensor
+
+
+def detect(image_rgb, caption, box_threshold, text_threshold):
+    """
+    Run GroundingDINO on image_rgb (batched with concurrent requests
+    when DINO_BATCH_MAX > 1).
+    Returns (boxes [cx, cy, w, h] normalized, logits, phrases).
+    """
+    return dino_detector((dino_tensor(image_rgb), caption, box_threshold, text_threshold))
+
+
+# =========================================================
+# CROSS-REQUEST MICRO-BATCHING (DINO + SAM ENCODER)
+# =========================================================
+# Requests that arrive within *_BATCH_WAIT_MS of each other share one
+# forward pass of up to *_BATCH_MAX images. 1 = off (inline, batch 1).
+# SAM encodes only batch as wide as the predictor pool lets requests
+# through, so raise SAM_POOL_SIZE along with SAM_BATCH_MAX.
+DINO_BATCH_MAX = int(os.getenv("DINO_BATCH_MAX", "1"))
+DINO_BATCH_WAIT_MS = float(os.getenv("DINO_BATCH_WAIT_MS", "10"))
+SAM_BATCH_MAX = int(os.getenv("SAM_BATCH_MAX", "1"))
+SAM_BATCH_WAIT_MS = float(os.getenv("SAM_BATCH_WAIT_MS", "10"))
+
+
+def dino_forward(items):
+    """
+    [(image_tensor, caption, box_threshold, text_threshold)] -> one
+    (boxes, logits, phrases) per item, same post-processing as predict().
+    """
+    model = get_dino_model()
+
+    if len(items) == 1:
+        image, caption, box_threshold, text_threshold = items[0]
+        return [predict(
+            model=model,
+            image=image,
+            caption=caption,
+            box_threshold=box_threshold,
+            text_threshold=text_threshold,
+            device="cpu"
+        )]
+
+    captions = [preprocess_caption(caption) for _, caption, _, _ in items]
+    with torch.no_grad():
+        # List input -> NestedTensor: mixed sizes are padded and masked
+        outputs = model([image for image, _, _, _ in items], captions=captions)
+
+    all_logits = outputs["pred_logits"].cpu().sigmoid()
+    all_boxes = outputs["pred_boxes"].cpu()
+    tokenizer = model.tokenizer
+
+    results = []
+    for i, (_, _, box_threshold, text_threshold) in enumerate(items):
+        logits, boxes = all_logits[i], all_boxes[i]
+        keep = logits.max(dim=1)[0] > box_threshold
+        logits, boxes = logits[keep], boxes[keep]
+
+        tokenized = tokenizer(captions[i])
+        phrases = [
+            get_phrases_from_posmap(logit > text_threshold, tokenized, tokenizer).replace(".", "")
+            for logit in logits
+        ]
+        results.append((boxes, logits.max(dim=1)[0], phrases))
+    return results
+
+
+def sam_encode(images_rgb):
+    """
+    [RGB uint8 arrays] -> one embedding entry per image
+    ({"features", "original_size", "input_size"}), same as set_image().
+    """
+    sam = get_sam_model()
+    transform = ResizeLongestSide(sam.image_encoder.img_size)
+
+    inputs, sizes = [], []
+    for image_rgb in images_rgb:
+        resized = torch.as_tensor(transform.apply_image(image_rgb), device=device)
+        resized = resized.permute(2, 0, 1).contiguous()[None, :, :, :]
+        sizes.append((tuple(image_rgb.shape[:2]), tuple(resized.shape[-2:])))
+        inputs.append(sam.preprocess(resized))
+
+    with torch.no_grad():
+        if isinstance(sam.image_encoder, TracedImageEncoder):
+            # Traced at batch 1: shapes are baked into the graph
+            features = [sam.image_encoder(x) for x in inputs]
+        elif len(inputs) == 1:
+            features = [sam.image_encoder(inputs[0])]
+        else:
+            batch = sam.image_encoder(torch.cat(inputs))
+            # clone so a cached entry doesn't pin the whole batch tensor
+            features = [batch[i:i + 1].clone() for i in range(len(inputs))]
+
+    return [
+        {"features": f, "original_size": original, "input_size": input_size}
+        for f, (original, input_size) in zip(features, sizes)
+    ]
+
+
+dino_detector = MicroBatcher("dino", dino_forward, DINO_BATCH_MAX, DINO_BATCH_WAIT_MS)
+sam_encoder = MicroBatcher("sam_encoder", sam_encode, SAM_BATCH_MAX, SAM_BATCH_WAIT_MS)
+
+
+def box_to_xyxy(box, w, h):
+    box = box * torch.tensor([w, h, w, h])
+    x_c, y_c, bw, bh = box.tolist()
+    return np.array([
+        int(x_c - bw / 2),
+        int(y_c - bh / 2),
+        int(x_c + bw / 2),
+        int(y_c + bh / 2)
+    ])
+
+
+def upsample_mask(logits, out_hw):
+    """
+    Bilinear-upsample SAM logits and threshold at 0 (SAM's mask
+    threshold). Interpolating logits rather than the binary mask gives
+    sub-pixel, non-blocky edges at full resolution.
+    """
+    out_h, out_w = out_hw
+    if logits.shape[:2] != (out_h, out_w):
+        logits = cv2.resize(
+            logits.astype(np.float32), (out_w, out_h),
+            interpolation=cv2.INTER_LINEAR
+        )
+    return logits > 0
+
+
+def predict_mask(predictor, box_xyxy, out_hw):
+    """
+    Box-prompted SAM mask (predictor must already hold the proxy image),
+    returned at out_hw resolution.
+    """
+    logits = predictor.predict(
+        box=box_xyxy, multimask_output=False, return_logits=True
+    )[0][0]
+    return upsample_mask(logits, out_hw)
+
+
+def segment(image_rgb, caption, box_threshold, text_threshold,
+            max_side: int = SEGMENT_MAX_SIDE):
+    """
+    Detect `caption` with DINO and segment the first box with SAM on a
+    bounded-size proxy. Returns a full-resolution bool mask or None.
+    """
+    h, w = image_rgb.shape[:2]
+    proxy = make_proxy(image_rgb, max_side)
+    ph, pw = proxy.shape[:2]
+
+    boxes, _, _ = detect(proxy, caption, box_threshold, text_threshold)
+    if len(boxes) == 0:
+        return None
+
+    with checkout_predictor() as predictor:
+        set_image_cached(predictor, proxy)
+        return predict_mask(predictor, box_to_xyxy(boxes[0], pw, ph), (h, w))
+
+
+# =========================================================
+# BACKWARD COMPAT: common_sam.dino_model / .sam / .sam_predictor
+# =========================================================
+def __getattr__(name):
+    if name == "dino_model":
+        return get_dino_model()
+    if name == "sam":
+        return get_sam_model()
+    if name == "sam_predictor":
+        return get_sam_predictor()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
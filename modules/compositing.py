@@ -0,0 +1,88 @@
+"""
+compositing.py
+---------------------------------
+Memory-lean texture compositing shared by background / flooring / room.
+
+Replaces the float64 pattern
+    alpha = GaussianBlur(mask.astype(float))[..., None]
+    out = tex * alpha + img * (1 - alpha)
+with uint8 alphas and 16-bit fixed-point accumulation in preallocated
+buffers. With COMPOSITE_TILE_ROWS > 0 the blend runs in horizontal bands
+so the scratch memory is bounded by the band size, not the image size.
+"""
+
+import os
+import cv2
+import numpy as np
+
+# Rows per band (0 = whole image in one pass)
+COMPOSITE_TILE_ROWS = int(os.getenv("COMPOSITE_TILE_ROWS", "0"))
+
+
+def feather_mask(mask, ksize: int):
+    """
+    bool/0-1 mask -> uint8 alpha (0..255) with a Gaussian-feathered edge.
+    """
+    alpha = np.multiply(mask, 255, dtype=np.uint8)
+    cv2.GaussianBlur(alpha, (ksize, ksize), 0, dst=alpha)
+    return alpha
+
+
+def exclusive_alpha(alpha, over_alpha):
+    """
+    Clamp alpha so alpha + over_alpha <= 255 (over_alpha wins on overlap).
+    Modifies alpha in place and returns it.
+    """
+    np.minimum(alpha, 255 - over_alpha, out=alpha)
+    return alpha
+
+
+def composite(base_bgr, layers, out=None, tile_rows: int = COMPOSITE_TILE_ROWS):
+    """
+    Blend one or more (texture_bgr, alpha_u8) layers over base_bgr:
+
+        out = (base * (255 - sum(a_i)) + sum(tex_i * a_i)) / 255
+
+    All inputs are uint8 and the same HxW; the layer alphas must not sum
+    past 255 (see exclusive_alpha). out may be base_bgr itself.
+    """
+    h, w = base_bgr.shape[:2]
+    if out is None:
+        out = np.empty_like(base_bgr)
+
+    rows = h if tile_rows <= 0 else min(tile_rows, h)
+
+    # Scratch buffers, reused for every band
+    acc = np.empty((rows, w, 3), dtype=np.uint16)
+    tmp = np.empty((rows, w, 3), dtype=np.uint16)
+    inv = np.empty((rows, w), dtype=np.uint8)
+
+    for r0 in range(0, h, rows):
+        r1 = min(r0 + rows, h)
+        n = r1 - r0
+        acc_t, tmp_t, inv_t = acc[:n], tmp[:n], inv[:n]
+
+        inv_t.fill(255)
+        for _, alpha in layers:
+            np.subtract(inv_t, alpha[r0:r1], out=inv_t)
+
+        np.multiply(base_bgr[r0:r1], inv_t[..., None], out=acc_t, dtype=np.uint16)
+        for tex, alpha in layers:
+            np.multiply(tex[r0:r1], alpha[r0:r1, :, None], out=tmp_t, dtype=np.uint16)
+            acc_t += tmp_t
+
+        # round-to-nearest divide by 255
+        acc_t += 127
+        np.floor_divide(acc_t, 255, out=acc_t)
+        np.copyto(out[r0:r1], acc_t, casting="unsafe")
+
+    return out
+
+
+def blend_texture(image_bgr, texture_bgr, mask, ksize: int,
+                  out=None, tile_rows: int = COMPOSITE_TILE_ROWS):
+    """
+    Single-texture shortcut: feather mask and composite texture over image.
+    """
+    alpha = feather_mask(mask, ksize)
+    return composite(image_bgr, [(texture_bgr, alpha)], out=out, tile_rows=tile_rows)
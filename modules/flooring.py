@@ -1,34 +1,21 @@
-import os
 import time
-import cv2
-import numpy as np
-import torch
-from PIL import Image
-import google.generativeai as genai
-from groundingdino.util.inference import predict, load_image
-from modules.common_sam import dino_model, sam_predictor
+from modules.ai_clients import GEMINI_IMAGE
+from modules.seg_pool import seg_pool
+from modules.storage import output_storage
+from modules.image_io import decode_upload, encode_image, save_debug
+from modules.texture_map import parse_tiles_across
+from modules.seam_quality import resolve_mode, should_refine, record_refine
+from modules.payloads import prepare
 
-OUTPUT_DIR = "static/output"
 
-# ---------------- GEMINI ----------------
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-gemini_model = genai.GenerativeModel("models/gemini-2.5-flash-image")
-
-
-def gemini_refine(image_path):
-    with open(image_path, "rb") as f:
-        img_bytes = f.read()
-
-    response = gemini_model.generate_content([
+def gemini_refine(payload):
+    response = GEMINI_IMAGE.generate_content([
         {
             "role": "user",
             "parts": [
                 {"text": "Remove seams, preserve shadows, make flooring realistic."},
                 {
-                    "inline_data": {
-                        "mime_type": "image/png",
-                        "data": img_bytes
-                    }
+                    "inline_data": payload
                 }
             ]
         }
@@ -42,58 +29,38 @@ def gemini_refine(image_path):
 
 
 def replace_floor(request):
-    ts = int(time.time())
-    os.makedirs(OUTPUT_DIR, exist_ok=True)
-
-    temp_path = os.path.join(OUTPUT_DIR, f"temp_{ts}.jpg")
-    request.files["target_image"].save(temp_path)
-
-    image_rgb, image_tensor = load_image(temp_path)
-    h, w, _ = image_rgb.shape
-    image_bgr = cv2.cvtColor(image_rgb, cv2.COLOR_RGB2BGR)
-
-    boxes, _, _ = predict(
-        model=dino_model,
-        image=image_tensor,
+    image_bgr = decode_upload(request.files["target_image"])
+    floor_tex = decode_upload(request.files["floor_image"])
+    tiles_across = parse_tiles_across(request.form.get("tiles_across"))
+
+    # DINO + SAM + tiled texture mapping + blend run in the
+    # segmentation pool (or inline)
+    blended, seam = seg_pool.segment_blend(
+        image_bgr, floor_tex,
         caption="floor, flooring, ground",
         box_threshold=0.30,
         text_threshold=0.25,
-        device="cpu"
+        ksize=25,
+        surface="floor",
+        tiles_across=tiles_across
     )
 
-    if len(boxes) == 0:
+    if blended is None:
         raise RuntimeError("No floor detected")
 
-    box = boxes[0] * torch.tensor([w, h, w, h])
-    x_c, y_c, bw, bh = box.tolist()
-
-    input_box = np.array([
-        int(x_c - bw / 2),
-        int(y_c - bh / 2),
-        int(x_c + bw / 2),
-        int(y_c + bh / 2)
-    ])
-
-    sam_predictor.set_image(image_rgb)
-    mask = sam_predictor.predict(box=input_box, multimask_output=False)[0][0]
-
-    floor_tex = cv2.imdecode(
-        np.frombuffer(request.files["floor_image"].read(), np.uint8),
-        cv2.IMREAD_COLOR
-    )
-    floor_tex = cv2.resize(floor_tex, (w, h))
-
-    alpha = cv2.GaussianBlur(mask.astype(float), (25, 25), 0)[..., None]
-    blended = (floor_tex * alpha + image_bgr * (1 - alpha)).astype(np.uint8)
+    save_debug("sam_floor", blended)
 
-    sam_out = os.path.join(OUTPUT_DIR, f"sam_floor_{ts}.png")
-    cv2.imwrite(sam_out, blended)
+    # Gemini seam cleanup only when the local composite needs it
+    mode = resolve_mode(request.form.get("refine"))
+    if not should_refine("floor", mode, seam):
+        return output_storage.save(encode_image(blended, ".png"), "final_floor", ".png")
 
-    refined = gemini_refine(sam_out)
-    final_path = os.path.join(OUTPUT_DIR, f"final_floor_{ts}.png")
+    blended_payload = prepare(blended, "lossless")
+    t0 = time.time()
 
-    with open(final_path, "wb") as f:
-        f.write(refined)
+    refined = gemini_refine(blended_payload)
+    record_refine("floor", time.time() - t0)
+    if refined is None:
+        raise RuntimeError("Gemini failed")
 
-    os.remove(temp_path)
-    return os.path.basename(final_path)
+    return output_storage.save(refined, "final_floor", ".png")
@@ -0,0 +1,48 @@
+"""
+image_io.py
+---------------------------------
+In-memory image helpers for the segmentation / Gemini paths.
+
+Uploads are decoded once straight from the request stream, encoded once
+into a memory buffer for whatever goes over the wire or gets persisted,
+and intermediates only hit the disk when DEBUG_INTERMEDIATES=1.
+"""
+
+import os
+import cv2
+import numpy as np
+from modules.storage import output_storage
+
+# Write sam_* composites etc. to static/output for inspection
+DEBUG_INTERMEDIATES = os.getenv("DEBUG_INTERMEDIATES", "0") == "1"
+
+
+def decode_upload(file_storage, flags=cv2.IMREAD_COLOR):
+    """
+    Uploaded file (werkzeug FileStorage) -> BGR uint8 array.
+    """
+    data = np.frombuffer(file_storage.read(), np.uint8)
+    image = cv2.imdecode(data, flags)
+    if image is None:
+        raise ValueError(f"Could not decode uploaded image: {file_storage.filename}")
+    return image
+
+
+def encode_image(image_bgr, ext: str = ".png", params=None) -> bytes:
+    """
+    BGR array -> encoded bytes (".png", ".jpg", ".webp", ...).
+    """
+    ok, buf = cv2.imencode(ext, image_bgr, params or [])
+    if not ok:
+        raise RuntimeError(f"Could not encode image as {ext}")
+    return buf.tobytes()
+
+
+def save_debug(prefix: str, image_bgr):
+    """
+    Persist an intermediate image, only when DEBUG_INTERMEDIATES is on.
+    Returns the storage key (or None).
+    """
+    if not DEBUG_INTERMEDIATES:
+        return None
+    return output_storage.save(encode_image(image_bgr, ".png"), prefix, ".png")
@@ -0,0 +1,167 @@
+"""
+janitor.py
+---------------------------------
+Background cleanup for static/output and static/tmp.
+
+1) Retention per artifact class (by key prefix):
+     intermediate  sam_*, step_*            JANITOR_RETAIN_INTERMEDIATE_HOURS
+     upload        multicolor_<id>, setup_* JANITOR_RETAIN_UPLOAD_HOURS
+     final         everything else          JANITOR_RETAIN_FINAL_HOURS
+2) Total disk quota (JANITOR_QUOTA_MB): oldest files go first (LRU by mtime)
+
+Never deleted:
+- keys pinned by in-flight work (storage.pin / pin_scope)
+- files younger than JANITOR_MIN_AGE_SECONDS (covers requests running
+  in other worker processes, whose pins this process cannot see)
+
+One sweep at a time across processes (lock file), metrics in /metrics.
+"""
+
+import os
+import re
+import time
+import threading
+from modules import metrics
+from modules.storage import output_storage, tmp_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server
+    fcntl = None
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+JANITOR_ENABLED = os.getenv("JANITOR_ENABLED", "1") == "1"
+JANITOR_INTERVAL_SECONDS = int(os.getenv("JANITOR_INTERVAL_SECONDS", "300"))
+JANITOR_MIN_AGE_SECONDS = int(os.getenv("JANITOR_MIN_AGE_SECONDS", "600"))
+JANITOR_QUOTA_MB = int(os.getenv("JANITOR_QUOTA_MB", "5120"))
+
+RETENTION_SECONDS = {
+    "intermediate": float(os.getenv("JANITOR_RETAIN_INTERMEDIATE_HOURS", "1")) * 3600,
+    "upload": float(os.getenv("JANITOR_RETAIN_UPLOAD_HOURS", "24")) * 3600,
+    "final": float(os.getenv("JANITOR_RETAIN_FINAL_HOURS", "168")) * 3600,
+}
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LOCK_PATH = os.path.join(BASE_DIR, "cache", "janitor.lock")
+
+# "<prefix>_<32 hex id>.<ext>"
+_KEY_RE = re.compile(r"^(?P<prefix>.+)_[0-9a-f]{32}\.[A-Za-z0-9]+$")
+
+INTERMEDIATE_PREFIXES = ("sam_", "step_")
+UPLOAD_PREFIXES = ("multicolor", "setup")
+
+
+def classify(key: str) -> str:
+    name = key.rsplit("/", 1)[-1]
+    m = _KEY_RE.match(name)
+    prefix = m.group("prefix") if m else name
+
+    if prefix.startswith(INTERMEDIATE_PREFIXES):
+        return "intermediate"
+    if prefix in UPLOAD_PREFIXES:
+        return "upload"
+    return "final"
+
+
+# =========================================================
+# 🔹 SWEEP
+# =========================================================
+def _delete(storage, key: str, size: int, reason: str, artifact: str):
+    try:
+        storage.delete(key)
+    except OSError as e:
+        print(f"[WARN] Janitor could not delete {key}: {e}")
+        return 0
+    metrics.incr("janitor.files_deleted")
+    metrics.incr(f"janitor.files_deleted.{reason}")
+    metrics.incr("janitor.bytes_reclaimed", size)
+    metrics.incr(f"janitor.bytes_reclaimed.{artifact}", size)
+    return size
+
+
+def sweep(storages=(output_storage, tmp_storage), now=None):
+    """
+    One cleanup pass. Returns bytes reclaimed.
+    """
+    now = now or time.time()
+    reclaimed = 0
+    survivors = []
+
+    for storage in storages:
+        for key, size, mtime in storage.list():
+            age = now - mtime
+            if age < JANITOR_MIN_AGE_SECONDS or storage.is_pinned(key):
+                survivors.append((mtime, size, storage, key, False))
+                continue
+
+            artifact = classify(key)
+            if age > RETENTION_SECONDS[artifact]:
+                reclaimed += _delete(storage, key, size, "retention", artifact)
+            else:
+                survivors.append((mtime, size, storage, key, True))
+
+    total = sum(size for _, size, _, _, _ in survivors)
+    quota = JANITOR_QUOTA_MB * 1024 * 1024
+
+    if total > quota:
+        survivors.sort(key=lambda s: s[0])
+        for mtime, size, storage, key, deletable in survivors:
+            if total <= quota:
+                break
+            if not deletable or storage.is_pinned(key):
+                continue
+            freed = _delete(storage, key, size, "quota", classify(key))
+            total -= freed
+
+    metrics.gauge("janitor.bytes_stored", total)
+    metrics.gauge("janitor.last_sweep", now)
+    return reclaimed
+
+
+def _sweep_locked():
+    if fcntl is None:
+        return sweep()
+
+    os.makedirs(os.path.dirname(LOCK_PATH), exist_ok=True)
+    with open(LOCK_PATH, "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return 0  # another worker is sweeping
+        try:
+            return sweep()
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def _run():
+    while True:
+        try:
+            t0 = time.time()
+            reclaimed = _sweep_locked()
+            if reclaimed:
+                print(f"🧹 Janitor reclaimed {reclaimed / 1e6:.1f} MB in {time.time() - t0:.1f}s")
+        except Exception as e:
+            print(f"[ERROR] Janitor sweep failed: {e}")
+        time.sleep(JANITOR_INTERVAL_SECONDS)
+
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+
+def ensure_running():
+    """
+    Start the janitor thread once per process (threads do not survive
+    gunicorn's fork, so this is safe to call on every request).
+    """
+    global _started_pid
+    if not JANITOR_ENABLED or _started_pid == os.getpid():
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        _started_pid = os.getpid()
+    threading.Thread(target=_run, name="janitor", daemon=True).start()
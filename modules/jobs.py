@@ -0,0 +1,184 @@
+"""
+jobs.py
+---------------------------------
+In-process async job queue for the slow model-backed routes.
+
+POST handlers snapshot the request (form + uploaded bytes), submit the
+module function to a bounded worker pool and return a job id right away.
+Clients poll /jobs/<id> or stream /jobs/<id>/stream (SSE) for status.
+
+No external broker: jobs live in this process only.
+"""
+
+import os
+import time
+import uuid
+import threading
+from io import BytesIO
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+from werkzeug.datastructures import FileStorage, MultiDict
+from modules.storage import pin_scope
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_QUEUE_LIMIT = int(os.getenv("JOB_QUEUE_LIMIT", "200"))
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", "3600"))
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class QueueFullError(RuntimeError):
+    """Raised when the job queue is at JOB_QUEUE_LIMIT."""
+
+
+# =========================================================
+# 🔹 REQUEST SNAPSHOT
+# =========================================================
+def snapshot_request(request):
+    """
+    Copy form fields and uploaded files out of a Flask request so the
+    module functions can run after the request context is gone.
+    The snapshot exposes the same .form / .files interface.
+    """
+    files = MultiDict()
+    for key, fs in request.files.items(multi=True):
+        data = fs.read()
+        files.add(key, FileStorage(
+            stream=BytesIO(data),
+            filename=fs.filename,
+            name=fs.name,
+            content_type=fs.content_type
+        ))
+
+    return SimpleNamespace(
+        method="POST",
+        form=request.form.copy(),
+        files=files
+    )
+
+
+# =========================================================
+# 🔹 JOB + QUEUE
+# =========================================================
+class Job:
+    def __init__(self, kind: str):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.status = QUEUED
+        self.result = None
+        self.error = None
+        self.progress = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.version = 0
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+            "progress": self.progress,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+        }
+
+
+class JobQueue:
+    def __init__(self, workers: int, limit: int, ttl: int):
+        self.limit = limit
+        self.ttl = ttl
+        self._pool = ThreadPoolExecutor(
+            max_workers=workers,
+            thread_name_prefix="job"
+        )
+        self._jobs = {}
+        self._active = 0
+        self._cond = threading.Condition()
+
+    def _touch(self, job: Job, **changes):
+        with self._cond:
+            for k, v in changes.items():
+                setattr(job, k, v)
+            job.version += 1
+            self._cond.notify_all()
+
+    def _prune(self):
+        cutoff = time.time() - self.ttl
+        stale = [
+            job_id for job_id, job in self._jobs.items()
+            if job.finished and job.finished < cutoff
+        ]
+        for job_id in stale:
+            del self._jobs[job_id]
+
+    def _run(self, job: Job, fn, args, kwargs):
+        self._touch(job, status=RUNNING, started=time.time())
+        try:
+            # Outputs written by the job are protected from the janitor
+            # until it finishes
+            with pin_scope():
+                result = fn(*args, **kwargs)
+        except Exception as e:
+            print(f"[ERROR] Job {job.id} ({job.kind}) failed: {e}")
+            self._touch(job, status=FAILED, error=str(e), finished=time.time())
+        else:
+            if isinstance(result, tuple):
+                result = list(result)
+            self._touch(job, status=DONE, result=result, finished=time.time())
+        finally:
+            with self._cond:
+                self._active -= 1
+
+    def submit(self, kind: str, fn, *args, with_progress: bool = False, **kwargs) -> Job:
+        """
+        Queue fn(*args, **kwargs). With with_progress=True, fn also gets an
+        on_progress(dict) callback whose payload shows up as job.progress.
+        """
+        with self._cond:
+            self._prune()
+            if self._active >= self.limit:
+                raise QueueFullError(
+                    f"Job queue full ({self._active}/{self.limit})"
+                )
+            job = Job(kind)
+            self._jobs[job.id] = job
+            self._active += 1
+
+        if with_progress:
+            kwargs["on_progress"] = lambda p: self._touch(job, progress=p)
+
+        self._pool.submit(self._run, job, fn, args, kwargs)
+        return job
+
+    def get(self, job_id: str):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    def wait_for_change(self, job: Job, version: int, timeout: float = 15.0):
+        """
+        Block until job.version != version or timeout.
+        Returns the current version.
+        """
+        with self._cond:
+            self._cond.wait_for(lambda: job.version != version, timeout=timeout)
+            return job.version
+
+    def stats(self):
+        with self._cond:
+            counts = {}
+            for job in self._jobs.values():
+                counts[job.status] = counts.get(job.status, 0) + 1
+            return {"active": self._active, "limit": self.limit, **counts}
+
+
+job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_LIMIT, JOB_TTL_SECONDS)
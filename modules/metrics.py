@@ -0,0 +1,45 @@
+"""
+metrics.py
+---------------------------------
+Tiny in-process metrics registry (counters, gauges, timings).
+Exposed as JSON at /metrics.
+"""
+
+import threading
+from collections import defaultdict
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = {}
+_timings = {}
+
+
+def incr(name: str, value: float = 1):
+    with _lock:
+        _counters[name] += value
+
+
+def gauge(name: str, value: float):
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, seconds: float):
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "total": 0.0, "max": 0.0})
+        t["count"] += 1
+        t["total"] += seconds
+        t["max"] = max(t["max"], seconds)
+
+
+def snapshot():
+    with _lock:
+        timings = {
+            name: {**t, "avg": t["total"] / t["count"] if t["count"] else 0.0}
+            for name, t in _timings.items()
+        }
+        return {
+            "counters": dict(_counters),
+            "gauges": dict(_gauges),
+            "timings": timings
+        }
@@ -1,24 +1,38 @@
 import os
 import time
 import base64
+from io import BytesIO
+import cv2
+import numpy as np
 from PIL import Image
-from modules.ai_clients import openai_client, GEMINI_IMAGE
-
-STATIC_OUTPUT = os.path.join("static", "output")
-
-
-# ---------- STEP 1: DETECT COLORS ----------
-def detect_multicolors(request):
-    ts = int(time.time())
-
-    image = request.files["multicolor_image"]
-    filename = f"multicolor_{ts}.jpg"
-    image_path = os.path.join(STATIC_OUTPUT, filename)
-
-    img = Image.open(image.stream).convert("RGB")
-    img.save(image_path, "JPEG", quality=90)
-
-    image_b64 = base64.b64encode(open(image_path, "rb").read()).decode()
+from modules.ai_clients import openai_chat, GEMINI_IMAGE
+from modules.result_cache import result_cache, cache_key, content_hash
+from modules.storage import output_storage, safe_prefix
+from modules.payloads import prepare
+from modules.color_detect import (
+    save_analysis, load_analysis, color_mask, BACKGROUND_LABEL
+)
+from modules.seg_pool import seg_pool
+from modules.recolor import resolve_color, recolor, engine_id, RECOLOR_FEATHER
+from modules.image_io import encode_image
+from modules.metrics import incr, observe
+
+
+# "local": k-means + named-color LUT (modules/color_detect.py)
+# "llm":   ask gpt-4o-mini (no fractions / masks)
+MULTICOLOR_DETECTOR = os.getenv("MULTICOLOR_DETECTOR", "local").lower()
+MULTICOLOR_LLM_FALLBACK = os.getenv("MULTICOLOR_LLM_FALLBACK", "1") == "1"
+
+# "local": mask-guided Lab recolor (modules/recolor.py)
+# "gemini": whole-image Gemini edit
+RECOLOR_MODE = os.getenv("RECOLOR_MODE", "local").lower()
+# Default for the Gemini seam-refine pass after a local recolor
+RECOLOR_REFINE = os.getenv("RECOLOR_REFINE", "0") == "1"
+
+
+def detect_colors_llm(img):
+    payload = prepare(img, "analysis")
+    image_b64 = base64.b64encode(payload["data"]).decode()
 
     prompt = """
 Identify DISTINCT product colors only.
@@ -26,7 +40,8 @@ Ignore background, shadows, and highlights.
 Return comma-separated color names.
 """
 
-    response = openai_client.chat.completions.create(
+    t0 = time.time()
+    response = openai_chat(
         model="gpt-4o-mini",
         messages=[{
             "role": "user",
@@ -35,29 +50,120 @@ Return comma-separated color names.
                 {
                     "type": "image_url",
                     "image_url": {
-                        "url": f"data:image/jpeg;base64,{image_b64}"
+                        "url": f"data:{payload['mime_type']};base64,{image_b64}"
                     }
                 }
             ]
         }]
     )
+    observe("multicolor.detect_llm", time.time() - t0)
 
     detected_colors = response.choices[0].message.content.strip()
-    color_list = [c.strip() for c in detected_colors.split(",") if c.strip()]
-
-    return color_list, filename, ts
+    return [
+        {"name": c.strip(), "fraction": None, "rgb": None, "label": None}
+        for c in detected_colors.split(",") if c.strip()
+    ]
 
 
-# ---------- STEP 2: MODIFY COLOR ----------
-def modify_detected_color(request):
+# ---------- STEP 1: DETECT COLORS ----------
+def detect_multicolors(request):
+    """
+    Returns (colors, filename, analysis_key, ts). analysis_key is None
+    when the LLM path was used (no masks to reuse).
+    """
     ts = int(time.time())
 
-    source_color = request.form["source_color"]
-    target_color = request.form["target_color"]
-    filename = request.form["filename"]
+    image = request.files["multicolor_image"]
+    img = Image.open(image.stream).convert("RGB")
+
+    # Full-size copy is persisted for step 2
+    buf = BytesIO()
+    img.save(buf, "JPEG", quality=90)
+    filename = output_storage.save(buf.getvalue(), "multicolor", ".jpg")
+
+    if MULTICOLOR_DETECTOR == "local":
+        try:
+            # DINO + SAM + k-means off the request thread (or inline)
+            colors, label_map = seg_pool.detect_colors(np.asarray(img))
+            if colors:
+                return colors, filename, save_analysis(colors, label_map), ts
+            print("[WARN] Local color detection found no colors")
+        except Exception as e:
+            if not MULTICOLOR_LLM_FALLBACK:
+                raise
+            print(f"[WARN] Local color detection failed: {e}")
+
+        if not MULTICOLOR_LLM_FALLBACK:
+            return [], filename, None, ts
+        incr("multicolor.llm_fallback")
+
+    return detect_colors_llm(img), filename, None, ts
 
-    img_path = os.path.join(STATIC_OUTPUT, filename)
-    img = Image.open(img_path).convert("RGB")
+
+# ---------- STEP 2: MODIFY COLOR ----------
+def refine_seams(image_bgr):
+    """Optional Gemini pass over a local recolor; returns bytes or None."""
+    payload = prepare(image_bgr, "lossless")
+    response = GEMINI_IMAGE.generate_content([
+        {
+            "role": "user",
+            "parts": [
+                {"text": "Clean up color seams at the edges of the recolored regions. "
+                         "Change nothing else."},
+                {"inline_data": payload}
+            ]
+        }
+    ])
+
+    for c in response.candidates:
+        for p in c.content.parts:
+            if p.inline_data:
+                return p.inline_data.data
+    return None
+
+
+def modify_local(image_bytes, source_color, target_color, analysis_key, refine):
+    """
+    Mask-guided local recolor. Returns encoded PNG bytes, or None if
+    either color can't be resolved (caller falls back to Gemini).
+    """
+    analysis = load_analysis(analysis_key)
+    colors, label_map = analysis if analysis else (None, None)
+
+    source_lab = resolve_color(source_color, colors)
+    target_lab = resolve_color(target_color)
+    if source_lab is None or target_lab is None:
+        return None
+
+    image_bgr = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    h, w = image_bgr.shape[:2]
+
+    # The stored label of the source color, grown so the Lab alpha (not
+    # the coarse proxy label edge) decides the boundary. A palette / hex
+    # source that wasn't detected falls back to the whole product.
+    region = None
+    if label_map is not None:
+        region = color_mask(colors, label_map, source_color, (h, w),
+                            grow=2 * RECOLOR_FEATHER + 1)
+        if region is None:
+            region = cv2.resize(
+                (label_map != BACKGROUND_LABEL).astype(np.uint8), (w, h),
+                interpolation=cv2.INTER_NEAREST
+            ).astype(bool)
+
+    out, _ = recolor(image_bgr, source_lab, target_lab, region)
+
+    if refine:
+        refined = refine_seams(out)
+        if refined is not None:
+            return refined
+        print("[WARN] Seam refine returned no image, keeping local recolor")
+
+    return encode_image(out, ".png", [cv2.IMWRITE_PNG_COMPRESSION, 1])
+
+
+def modify_gemini(image_bytes, source_color, target_color):
+    img = prepare(image_bytes, "edit")
 
     prompt = f"""
 Change ONLY regions with color {source_color} to {target_color}.
@@ -65,14 +171,61 @@ Preserve all textures, folds, shadows.
 Do NOT alter background or other colors.
 """
 
-    out_filename = f"multicolor_{source_color}_to_{target_color}_{ts}.png"
-    output_path = os.path.join(STATIC_OUTPUT, out_filename)
-
     gemini = GEMINI_IMAGE.generate_content([prompt, img])
 
     for part in gemini.candidates[0].content.parts:
         if part.inline_data:
-            with open(output_path, "wb") as f:
-                f.write(part.inline_data.data)
+            return part.inline_data.data
+    return None
+
+
+def modify_detected_color(request):
+    ts = int(time.time())
+
+    source_color = request.form["source_color"]
+    target_color = request.form["target_color"]
+    filename = request.form["filename"]
+    analysis_key = request.form.get("analysis")
+    refine = request.form.get("refine", "1" if RECOLOR_REFINE else "0") in ("1", "on")
+
+    image_bytes = output_storage.read(filename)
+
+    local = RECOLOR_MODE == "local"
+    if local:
+        engine = engine_id()
+        if refine:
+            engine += "+" + GEMINI_IMAGE.model_name
+    else:
+        engine = GEMINI_IMAGE.model_name
+
+    key = cache_key(
+        content_hash(image_bytes),
+        "modify_detected_color",
+        {"source_color": source_color, "target_color": target_color,
+         "analysis": analysis_key if local else None},
+        engine
+    )
+    cached = result_cache.get(key, "modify_detected_color")
+    if cached:
+        return cached, ts
+
+    data = None
+    if local:
+        data = modify_local(image_bytes, source_color, target_color, analysis_key, refine)
+        if data is None:
+            print(f"[WARN] Unknown color {source_color!r} / {target_color!r}, using Gemini")
+            incr("recolor.gemini_fallback")
+
+    if data is None:
+        data = modify_gemini(image_bytes, source_color, target_color)
+
+    out_filename = None
+    if data is not None:
+        out_filename = output_storage.save(
+            data,
+            safe_prefix(f"multicolor_{source_color}_to_{target_color}"),
+            ".png"
+        )
+        result_cache.put(key, out_filename, "modify_detected_color")
 
     return out_filename, ts
@@ -1,9 +1,8 @@
-import os
 import time
-from PIL import Image
 from modules.ai_clients import GEMINI_IMAGE
-
-STATIC_OUTPUT = os.path.join("static", "output")
+from modules.result_cache import result_cache, cache_key, content_hash
+from modules.storage import output_storage
+from modules.payloads import prepare
 
 def replace_accessory(request):
     ts = int(time.time())
@@ -11,7 +10,19 @@ def replace_accessory(request):
     image = request.files["accessory_image"]
     new_accessory = request.form["new_accessory"]
 
-    img = Image.open(image.stream).convert("RGB")
+    image_bytes = image.read()
+
+    key = cache_key(
+        content_hash(image_bytes),
+        "replace_accessory",
+        {"new_accessory": new_accessory},
+        GEMINI_IMAGE.model_name
+    )
+    cached = result_cache.get(key, "replace_accessory")
+    if cached:
+        return cached, ts
+
+    img = prepare(image_bytes, "edit")
 
     prompt = f"""
 You are a professional image editor.
@@ -28,14 +39,16 @@ Rules:
 - Do NOT alter background
 """
 
-    out_filename = f"replaced_accessory_{ts}.png"
-    output_path = os.path.join(STATIC_OUTPUT, out_filename)
+    out_filename = None
 
     gemini = GEMINI_IMAGE.generate_content([prompt, img])
 
     for part in gemini.candidates[0].content.parts:
         if part.inline_data:
-            with open(output_path, "wb") as f:
-                f.write(part.inline_data.data)
+            out_filename = output_storage.save(
+                part.inline_data.data, "replaced_accessory", ".png"
+            )
+            result_cache.put(key, out_filename, "replace_accessory")
+            break
 
     return out_filename, ts
@@ -0,0 +1,87 @@
+"""
+payloads.py
+---------------------------------
+Payload preparation before images go to Gemini / OpenAI.
+
+Each operation picks a profile: the image is resized to the model's
+effective input resolution and encoded in the cheapest format that is
+good enough (JPEG/WebP for analysis, lossless PNG only where seams or
+exact pixels matter). Override per profile with env vars, e.g.
+PAYLOAD_ANALYSIS_MAX_SIDE=768, PAYLOAD_ANALYSIS_FORMAT=WEBP.
+
+Callers prepare an image once per request / job and reuse the payload
+for every call that sends it (e.g. product_color's per-color fan-out).
+"""
+
+import os
+from io import BytesIO
+import cv2
+import numpy as np
+from PIL import Image
+
+
+def _profile(name: str, max_side: int, fmt: str, quality: int = None):
+    env = f"PAYLOAD_{name.upper()}_"
+    return {
+        "max_side": int(os.getenv(env + "MAX_SIDE", str(max_side))),
+        "format": os.getenv(env + "FORMAT", fmt).upper(),
+        "quality": int(os.getenv(env + "QUALITY", str(quality or 0))),
+    }
+
+
+PROFILES = {
+    # color detection, scene analysis: only needs the gist
+    "analysis": _profile("analysis", 1024, "JPEG", 85),
+    # the image Gemini edits and returns
+    "edit": _profile("edit", 1536, "JPEG", 92),
+    # fabric swatches, replacement product photos
+    "reference": _profile("reference", 768, "JPEG", 90),
+    # SAM composites sent for seam cleanup: no compression artifacts
+    "lossless": _profile("lossless", 2048, "PNG"),
+}
+
+MIME_TYPES = {"JPEG": "image/jpeg", "WEBP": "image/webp", "PNG": "image/png"}
+
+
+def _to_pil(image):
+    if isinstance(image, Image.Image):
+        return image.convert("RGB") if image.mode != "RGB" else image
+    if isinstance(image, np.ndarray):
+        # OpenCV arrays in this codebase are BGR
+        return Image.fromarray(cv2.cvtColor(image, cv2.COLOR_BGR2RGB))
+    if isinstance(image, (bytes, bytearray)):
+        return Image.open(BytesIO(image)).convert("RGB")
+    raise TypeError(f"Unsupported image type: {type(image).__name__}")
+
+
+def _downscale(image, max_side: int):
+    if isinstance(image, np.ndarray):
+        h, w = image.shape[:2]
+        scale = max_side / max(h, w)
+        if scale < 1:
+            size = (max(1, round(w * scale)), max(1, round(h * scale)))
+            image = cv2.resize(image, size, interpolation=cv2.INTER_AREA)
+        return _to_pil(image)
+
+    img = _to_pil(image)
+    if max(img.size) > max_side:
+        img = img.copy()
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+    return img
+
+
+def prepare(image, profile: str) -> dict:
+    """
+    PIL image / BGR array / encoded bytes -> {"mime_type", "data"},
+    usable directly as a Gemini content part or inline_data.
+    """
+    p = PROFILES[profile]
+    img = _downscale(image, p["max_side"])
+
+    buf = BytesIO()
+    if p["format"] == "PNG":
+        img.save(buf, format="PNG", compress_level=1)
+    else:
+        img.save(buf, format=p["format"], quality=p["quality"])
+
+    return {"mime_type": MIME_TYPES[p["format"]], "data": buf.getvalue()}
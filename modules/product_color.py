@@ -1,14 +1,19 @@
 import os
 import time
+import hashlib
+import contextvars
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, wait
 from PIL import Image
 from modules.ai_clients import GEMINI_IMAGE
+from modules.textures import TextureRegistry
+from modules.result_cache import result_cache, cache_key, content_hash
+from modules.storage import output_storage, safe_prefix
+from modules.payloads import prepare
 
 # ---------------- PATHS ----------------
-STATIC_OUTPUT = os.path.join("static", "output")
 TEXTURE_DIR = os.path.join("static", "textures")
 
-os.makedirs(STATIC_OUTPUT, exist_ok=True)
-
 # ---------------- COLOR MAP ----------------
 COLOR_FABRIC_MAP = {
     "Midnight Green": "Midnight Green New.jpg",
@@ -30,43 +35,58 @@ COLOR_FABRIC_MAP = {
     "Wild Wind": "WILD WIND.jpg"
 }
 
-# =========================================================
-# ✅ MAIN FUNCTION CALLED FROM app.py
-# =========================================================
-def product_color(request):
-    ts = int(time.time())
-
-    target_file = request.files.get("target_image")
-    color_target = request.form.get("color_target", "product")
-    selected_colors = request.form.getlist("colors")
-
-    if not target_file or not selected_colors:
-        return None, None
-
-    try:
-        target_img = Image.open(target_file.stream).convert("RGB")
-    except Exception as e:
-        print("[ERROR] Invalid target image:", e)
-        return None, None
+# Swatches are decoded + encoded once, not per request
+FABRIC_TEXTURES = TextureRegistry(TEXTURE_DIR, COLOR_FABRIC_MAP)
 
-    results = []
+# ---------------- FAN-OUT ----------------
+# Max concurrent Gemini calls per request (1 = serial)
+PRODUCT_COLOR_MAX_IN_FLIGHT = int(os.getenv("PRODUCT_COLOR_MAX_IN_FLIGHT", "6"))
+# Per-call timeout (seconds) passed to Gemini
+PRODUCT_COLOR_CALL_TIMEOUT = float(os.getenv("PRODUCT_COLOR_CALL_TIMEOUT", "90"))
 
-    for color in selected_colors:
-        color_key = color.strip()
 
-        if color_key not in COLOR_FABRIC_MAP:
-            print(f"[WARN] Unsupported color: {color_key}")
-            continue
-
-        fabric_path = os.path.join(TEXTURE_DIR, COLOR_FABRIC_MAP[color_key])
-
-        if not os.path.exists(fabric_path):
-            print(f"[WARN] Missing fabric image: {fabric_path}")
-            continue
-
-        fabric_img = Image.open(fabric_path).convert("RGB")
-
-        prompt = f"""
+# =========================================================
+# 🔹 SINGLE COLOR (ONE GEMINI CALL)
+# =========================================================
+def render_color(target_img, color_key, color_target, ts, timeout=None,
+                 image_digest=None):
+    """
+    Recolor target_img (PIL image or prepared payload) with one fabric
+    swatch. Returns a result dict, or None if this color failed.
+    image_digest (content hash of the upload) enables the result cache.
+    """
+    if color_key not in COLOR_FABRIC_MAP:
+        print(f"[WARN] Unsupported color: {color_key}")
+        return None
+
+    fabric_img = FABRIC_TEXTURES.get(color_key)
+
+    if fabric_img is None:
+        print(f"[WARN] Missing fabric image for {color_key}")
+        return None
+
+    label = f"{color_target.capitalize()} → {color_key}"
+
+    if not isinstance(target_img, dict):
+        target_img = prepare(target_img, "edit")
+
+    key = None
+    if image_digest:
+        key = cache_key(
+            image_digest,
+            "product_color",
+            {
+                "color": color_key,
+                "color_target": color_target,
+                "fabric": hashlib.sha256(fabric_img["data"]).hexdigest(),
+            },
+            GEMINI_IMAGE.model_name
+        )
+        cached = result_cache.get(key, "product_color")
+        if cached:
+            return {"label": label, "filename": cached}
+
+    prompt = f"""
 You are a professional textile color matching expert.
 
 TASK:
@@ -83,46 +103,112 @@ IMAGE ORDER:
 2) Fabric Reference
 """
 
-        filename = f"{color_target}_{color_key.replace(' ', '_')}_{ts}.png"
-        output_path = os.path.join(STATIC_OUTPUT, filename)
+    request_options = {"timeout": timeout} if timeout else None
+
+    try:
+        response = GEMINI_IMAGE.generate_content(
+            [prompt, target_img, fabric_img],
+            generation_config={"temperature": 0.2},
+            request_options=request_options,
+            # Retries + rate limiting stop at the same budget, so nothing
+            # outlives render_colors' wait below
+            deadline=timeout
+        )
+    except Exception as e:
+        print(f"[ERROR] Gemini failed for {color_key}: {e}")
+        return None
+
+    if not getattr(response, "candidates", None):
+        print("[ERROR] Gemini returned no candidates")
+        return None
+
+    for part in response.candidates[0].content.parts:
+        data = None
+
+        if hasattr(part, "inline_data") and part.inline_data:
+            data = part.inline_data.data
+        elif hasattr(part, "data"):
+            data = part.data
 
-        try:
-            response = GEMINI_IMAGE.generate_content(
-                [prompt, target_img, fabric_img],
-                generation_config={"temperature": 0.2}
+        if data:
+            filename = output_storage.save(
+                data, safe_prefix(f"{color_target}_{color_key}"), ".png"
             )
-        except Exception as e:
-            print(f"[ERROR] Gemini failed for {color_key}: {e}")
+            if key:
+                result_cache.put(key, filename, "product_color")
+            return {"label": label, "filename": filename}
+
+    print(f"[ERROR] No image returned for {color_key}")
+    return None
+
+
+def render_colors(target_img, color_keys, color_target, ts,
+                  max_in_flight=PRODUCT_COLOR_MAX_IN_FLIGHT,
+                  timeout=PRODUCT_COLOR_CALL_TIMEOUT,
+                  image_digest=None):
+    """
+    Fan out one Gemini call per color, at most max_in_flight at a time.
+    Failed colors are dropped; the rest keep the requested order.
+    """
+    max_in_flight = max(1, min(max_in_flight, len(color_keys)))
+
+    # Encode the product photo once for all colors
+    if not isinstance(target_img, dict):
+        target_img = prepare(target_img, "edit")
+
+    pool = ThreadPoolExecutor(max_workers=max_in_flight,
+                              thread_name_prefix="product_color")
+    futures = [
+        # copy_context: keep the caller's storage pin scope in the workers
+        pool.submit(contextvars.copy_context().run, render_color,
+                    target_img, key, color_target, ts, timeout, image_digest)
+        for key in color_keys
+    ]
+
+    # Each call (retries included) gives up after `timeout`, so every wave
+    # ends within `timeout`; this is a backstop for calls that hang past it.
+    waves = -(-len(futures) // max_in_flight)
+    _, not_done = wait(futures, timeout=timeout * waves + 5)
+    pool.shutdown(wait=False, cancel_futures=True)
+
+    results = []
+    for key, future in zip(color_keys, futures):
+        if future in not_done:
+            print(f"[ERROR] Timed out waiting for {key}")
             continue
+        result = future.result()
+        if result:
+            results.append(result)
 
-        image_written = False
+    return results
 
-        if not getattr(response, "candidates", None):
-            print("[ERROR] Gemini returned no candidates")
-            continue
 
-        for part in response.candidates[0].content.parts:
-            data = None
+# =========================================================
+# ✅ MAIN FUNCTION CALLED FROM app.py
+# =========================================================
+def product_color(request):
+    ts = int(time.time())
+
+    target_file = request.files.get("target_image")
+    color_target = request.form.get("color_target", "product")
+    selected_colors = request.form.getlist("colors")
 
-            if hasattr(part, "inline_data") and part.inline_data:
-                data = part.inline_data.data
-            elif hasattr(part, "data"):
-                data = part.data
+    if not target_file or not selected_colors:
+        return None, None
 
-            if data:
-                with open(output_path, "wb") as f:
-                    f.write(data)
-                image_written = True
-                break
+    target_bytes = target_file.read()
 
-        if not image_written:
-            print(f"[ERROR] No image returned for {color_key}")
-            continue
+    try:
+        target_img = Image.open(BytesIO(target_bytes)).convert("RGB")
+    except Exception as e:
+        print("[ERROR] Invalid target image:", e)
+        return None, None
 
-        results.append({
-            "label": f"{color_target.capitalize()} → {color_key}",
-            "filename": filename
-        })
+    color_keys = [color.strip() for color in selected_colors]
+    results = render_colors(
+        target_img, color_keys, color_target, ts,
+        image_digest=content_hash(target_bytes)
+    )
 
     if not results:
         return None, None
@@ -1,17 +1,10 @@
-import base64
-import os
-import time
 import json
+import time
 from io import BytesIO
 from PIL import Image
-import google.generativeai as genai
-
-# ================== CONFIG ==================
-TMP_DIR = os.path.join("static", "tmp")
-os.makedirs(TMP_DIR, exist_ok=True)
-
-genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-model = genai.GenerativeModel("gemini-2.5-flash-image")
+from modules.ai_clients import GEMINI_IMAGE
+from modules.storage import output_storage, tmp_storage
+from modules.payloads import prepare
 
 
 # ------------------------------------------------
@@ -23,17 +16,12 @@ def analyze_image(request):
 
     image = Image.open(request.files["setup"]).convert("RGB")
 
-    ts = int(time.time())
-    setup_filename = f"setup_{ts}.png"
-    setup_path = os.path.join(TMP_DIR, setup_filename)
-
-    # ✅ SAVE IMAGE
-    image.save(setup_path)
+    # ✅ SAVE IMAGE (key is posted back in step 2)
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    setup_path = tmp_storage.save(buf.getvalue(), "setup", ".png")
 
-    if not os.path.exists(setup_path):
-        raise RuntimeError(f"Failed to save setup image at {setup_path}")
-
-    response = model.generate_content([
+    response = GEMINI_IMAGE.generate_content([
         """
         Identify all distinct visible objects and fabrics.
 
@@ -51,7 +39,7 @@ def analyze_image(request):
           ]
         }
         """,
-        image
+        prepare(image, "analysis")
     ])
 
     try:
@@ -68,17 +56,21 @@ def analyze_image(request):
 # ------------------------------------------------
 # STEP 2: MULTI OBJECT REPLACEMENT (SAFE + SEQUENTIAL)
 # ------------------------------------------------
-def replace_product(request):
+def collect_replacements(request):
+    """
+    Read the selected (item_name, replacement image) pairs out of the
+    request. Must run inside the request context.
+    """
     if "setup_path" not in request.form:
         raise ValueError("Missing setup_path in form")
 
     setup_path = request.form["setup_path"]
 
-    if not os.path.exists(setup_path):
+    if not tmp_storage.exists(setup_path):
         raise FileNotFoundError(f"Setup image not found: {setup_path}")
 
-    current_image = Image.open(setup_path).convert("RGB")
     selected_items = request.form.getlist("selected_items")
+    replacements = []
 
     for file_key in request.files:
         if not file_key.startswith("product_"):
@@ -90,9 +82,32 @@ def replace_product(request):
         if item_name not in selected_items:
             continue
 
-        product_img = Image.open(request.files[file_key]).convert("RGB")
+        # Encoded once here; only used as a reference by Gemini
+        product_img = prepare(Image.open(request.files[file_key]), "reference")
+        replacements.append((item_name, product_img))
+
+    return setup_path, replacements
+
 
-        response = model.generate_content([
+def iter_replace_product(setup_path, replacements):
+    """
+    Run the Gemini chain, yielding one event per step:
+      {"event": "step", "index", "total", "item", "seconds", "key"}
+    and finally:
+      {"event": "done", "key", "seconds"}
+    Each step's output is stored as an intermediate (step_replace_*) file.
+    """
+    t_start = time.time()
+    # Full-resolution bytes are kept for the final output; Gemini gets
+    # the downscaled "edit" payload of the latest step.
+    current_bytes = tmp_storage.read(setup_path)
+    current_image = prepare(current_bytes, "edit")
+    total = len(replacements)
+
+    for i, (item_name, product_img) in enumerate(replacements, start=1):
+        t0 = time.time()
+
+        response = GEMINI_IMAGE.generate_content([
             f"""
             Replace ONLY the object named:
             "{item_name}"
@@ -112,16 +127,42 @@ def replace_product(request):
                 image_bytes = part.inline_data.data
                 break
 
+        step_key = None
         if image_bytes:
-            buffer = BytesIO(image_bytes)
-            buffer.seek(0)
-            img = Image.open(buffer)
-            img.load()
-            current_image = img.convert("RGB")
+            current_bytes = image_bytes
+            current_image = prepare(image_bytes, "edit")
+            step_key = output_storage.save(image_bytes, "step_replace", ".png")
+        else:
+            print(f"[WARN] Gemini returned no image for {item_name}")
+
+        yield {
+            "event": "step",
+            "index": i,
+            "total": total,
+            "item": item_name,
+            "seconds": round(time.time() - t0, 2),
+            "key": step_key,
+        }
 
     # ✅ FINAL OUTPUT
-    out = BytesIO()
-    current_image.save(out, format="PNG")
-    out.seek(0)
+    final_key = output_storage.save(current_bytes, "replaced_product", ".png")
+
+    yield {
+        "event": "done",
+        "key": final_key,
+        "seconds": round(time.time() - t_start, 2),
+    }
+
+
+def replace_product(request):
+    """
+    Blocking variant: returns the storage key of the final image.
+    """
+    setup_path, replacements = collect_replacements(request)
+
+    final_key = None
+    for event in iter_replace_product(setup_path, replacements):
+        if event["event"] == "done":
+            final_key = event["key"]
 
-    return base64.b64encode(out.read()).decode("utf-8")
+    return final_key
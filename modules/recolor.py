@@ -0,0 +1,175 @@
+"""
+recolor.py
+---------------------------------
+Deterministic local recolor for modify_detected_color.
+
+  mask:  soft alpha from the (L-down-weighted) Lab distance to the source
+         color, looked up per 32^3 RGB bin, optionally limited to the
+         product mask from detection
+  shift: a/b and L move by (target - source), so shading, folds and
+         texture keep their lightness differences; L rolls off softly
+         near black / white instead of clipping flat. Done with a
+         per-channel LUT on 8-bit Lab over the mask's bounding box
+  blend: uint8 fixed-point composite (modules/compositing.py)
+
+Gemini is only involved if seam refinement is asked for.
+"""
+
+import os
+import re
+import time
+import cv2
+import numpy as np
+from modules.color_detect import NAMED_COLORS, MULTICOLOR_L_WEIGHT
+from modules.compositing import feather_mask, composite
+from modules.metrics import observe
+
+# Pixels within RECOLOR_MAX_DE of the source get alpha 1, fading to 0
+# over the next RECOLOR_SOFT_DE units
+RECOLOR_MAX_DE = float(os.getenv("RECOLOR_MAX_DE", "22"))
+RECOLOR_SOFT_DE = float(os.getenv("RECOLOR_SOFT_DE", "10"))
+RECOLOR_FEATHER = int(os.getenv("RECOLOR_FEATHER", "5"))
+# Width (8-bit L levels) of the soft roll-off at the end L is shifted
+# towards; folds that would land past black / white are compressed into it
+RECOLOR_L_KNEE = float(os.getenv("RECOLOR_L_KNEE", "40"))
+
+
+def engine_id() -> str:
+    """Identifies this recolor's output for the result cache key."""
+    return f"local-recolor:{RECOLOR_MAX_DE}:{RECOLOR_SOFT_DE}:{RECOLOR_FEATHER}"
+
+
+_HEX = re.compile(r"^#?([0-9a-fA-F]{6})$")
+
+
+def rgb_to_lab(rgb):
+    px = np.array(rgb, np.float32).reshape(1, 1, 3) / 255.0
+    return cv2.cvtColor(px, cv2.COLOR_RGB2LAB).reshape(3)
+
+
+def resolve_color(name: str, colors=None):
+    """
+    Color name / "#rrggbb" -> Lab, or None if unknown. Detected colors
+    (with their measured cluster rgb) take priority over the palette.
+    """
+    for c in colors or ():
+        if c["name"] == name and c.get("rgb"):
+            return rgb_to_lab(c["rgb"])
+
+    for known, rgb in NAMED_COLORS.items():
+        if known.lower() == name.strip().lower():
+            return rgb_to_lab(rgb)
+
+    m = _HEX.match(name.strip())
+    if m:
+        v = m.group(1)
+        return rgb_to_lab([int(v[i:i + 2], 16) for i in (0, 2, 4)])
+
+    return None
+
+
+LUT_BITS = 5  # alpha is looked up per 32^3 RGB bin
+
+
+def _alpha_lut(source_lab):
+    """Per RGB bin alpha (uint8) from the weighted Lab distance."""
+    levels = 1 << LUT_BITS
+    step = 256 // levels
+    axis = np.arange(levels, dtype=np.float32) * step + step / 2
+    # index order matches _bin_index: b, g, r
+    b, g, r = np.meshgrid(axis, axis, axis, indexing="ij")
+    rgb = np.stack([r, g, b], -1).reshape(-1, 1, 3) / 255.0
+    lab = cv2.cvtColor(rgb, cv2.COLOR_RGB2LAB).reshape(-1, 3)
+
+    weights = np.array([MULTICOLOR_L_WEIGHT, 1.0, 1.0], np.float32)
+    dist = np.sqrt((((lab - source_lab) * weights) ** 2).sum(1))
+
+    soft = max(RECOLOR_SOFT_DE, 1e-3)
+    alpha = np.clip((RECOLOR_MAX_DE + soft - dist) * (255.0 / soft), 0, 255)
+    return alpha.astype(np.uint8)
+
+
+def _bin_index(image_bgr):
+    shift = 8 - LUT_BITS
+    q = np.right_shift(image_bgr, shift).astype(np.uint16)
+    idx = q[..., 0] << (2 * LUT_BITS)
+    idx |= q[..., 1] << LUT_BITS
+    idx |= q[..., 2]
+    return idx
+
+
+def color_alpha(image_bgr, source_lab, region=None):
+    """
+    uint8 alpha (0..255): how much each pixel belongs to source_lab.
+    region (bool, same HxW) limits the result, e.g. to the product.
+    """
+    alpha = _alpha_lut(source_lab)[_bin_index(image_bgr)]
+
+    if region is not None:
+        # Feather the region edge too so it doesn't cut a hard line
+        np.minimum(alpha, feather_mask(region, RECOLOR_FEATHER * 2 + 1), out=alpha)
+
+    if RECOLOR_FEATHER > 0:
+        k = RECOLOR_FEATHER * 2 + 1
+        cv2.GaussianBlur(alpha, (k, k), 0, dst=alpha)
+    return alpha
+
+
+def _soft_shift(v, shift: float):
+    """
+    v + shift, rolled off with tanh inside the last `knee` levels on the
+    side it moves towards: monotonic, identity for shift 0, and a fold
+    of any depth keeps some contrast instead of clipping to 0 / 255.
+    """
+    out = v + shift
+    knee = min(RECOLOR_L_KNEE, abs(shift))
+    if knee <= 0:
+        return out
+    if shift > 0:
+        hi = 255.0 - knee
+        over = out > hi
+        out[over] = hi + knee * np.tanh((out[over] - hi) / knee)
+    else:
+        under = out < knee
+        out[under] = knee - knee * np.tanh((knee - out[under]) / knee)
+    return out
+
+
+def _shift_lut(source_lab, target_lab):
+    """
+    (1, 256, 3) LUT over OpenCV 8-bit Lab (L*255/100, a+128, b+128):
+    a/b offset, L offset with a soft roll-off.
+    """
+    v = np.arange(256, dtype=np.float32)
+    lut = np.stack([
+        _soft_shift(v.copy(), (target_lab[0] - source_lab[0]) * 255.0 / 100.0),
+        v + (target_lab[1] - source_lab[1]),
+        v + (target_lab[2] - source_lab[2]),
+    ], -1)
+    return np.clip(lut + 0.5, 0, 255).astype(np.uint8).reshape(1, 256, 3)
+
+
+def shift_color(image_bgr, source_lab, target_lab):
+    """BGR uint8 -> BGR uint8 with source_lab moved onto target_lab."""
+    lab = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2LAB)
+    cv2.LUT(lab, _shift_lut(source_lab, target_lab), dst=lab)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
+
+def recolor(image_bgr, source_lab, target_lab, region=None):
+    """
+    Returns (recolored_bgr, alpha). Pixels outside the source color are
+    untouched; the shift itself only runs on their bounding box.
+    """
+    t0 = time.time()
+    out = image_bgr.copy()
+
+    alpha = color_alpha(image_bgr, source_lab, region)
+    x, y, w, h = cv2.boundingRect(alpha)
+    if w and h:
+        roi = (slice(y, y + h), slice(x, x + w))
+        shifted = shift_color(image_bgr[roi], source_lab, target_lab)
+        composite(image_bgr[roi], [(shifted, alpha[roi])], out=out[roi])
+
+    observe("recolor.local", time.time() - t0)
+    return out, alpha
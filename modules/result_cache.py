@@ -0,0 +1,223 @@
+"""
+result_cache.py
+---------------------------------
+Result cache for deterministic edit requests.
+
+Key = input image content hash + operation + prompt params + model name.
+Value = an output key already in output storage (static/output), so a
+hit is served without calling the model.
+
+- Index is persisted as JSON (survives restarts); every write merges
+  with the on-disk copy under a lock file, so entries added by other
+  gunicorn workers are kept, and a miss re-reads the file when its mtime
+  changed, so they are also served
+- Size-based LRU eviction and TTL over the index entries only: the
+  output files themselves may already have been returned to users or be
+  pinned by in-flight jobs, so deleting them is left to the janitor
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from modules import metrics
+from modules.storage import output_storage
+
+try:
+    import fcntl
+except ImportError:  # Windows: single-process dev server
+    fcntl = None
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+RESULT_CACHE_INDEX = os.getenv(
+    "RESULT_CACHE_INDEX",
+    os.path.join(BASE_DIR, "cache", "result_index.json")
+)
+RESULT_CACHE_MAX_MB = int(os.getenv("RESULT_CACHE_MAX_MB", "1024"))
+RESULT_CACHE_TTL_SECONDS = int(os.getenv("RESULT_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+# Set RESULT_CACHE_ENABLED=0 to always call the model
+RESULT_CACHE_ENABLED = os.getenv("RESULT_CACHE_ENABLED", "1") == "1"
+
+
+def content_hash(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def cache_key(image_digest: str, operation: str, params: dict, model_name: str) -> str:
+    payload = json.dumps(
+        [image_digest, operation, params, model_name],
+        sort_keys=True,
+        ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, storage, index_path: str,
+                 max_bytes: int, ttl: int, enabled: bool = True):
+        self.storage = storage
+        self.index_path = index_path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        # key -> {"filename", "size", "created", "last_used", "operation"}
+        self._disk_mtime = None
+        self._index = self._read_disk()
+        # key -> time this process dropped it (applied on the next merge)
+        self._dropped = {}
+
+    # ---------------- persistence ----------------
+    def _index_mtime(self):
+        try:
+            return os.stat(self.index_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _read_disk(self):
+        self._disk_mtime = self._index_mtime()
+        if self._disk_mtime is None:
+            return {}
+        try:
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"[WARN] Ignoring unreadable result cache index: {e}")
+            return {}
+
+    def _merge(self, disk):
+        """
+        Union of the on-disk index and ours: the most recently used copy
+        of each entry wins, entries we dropped stay dropped unless another
+        worker re-created them afterwards.
+        """
+        merged = dict(disk)
+        for key, dropped_at in self._dropped.items():
+            entry = merged.get(key)
+            if entry is not None and entry["created"] <= dropped_at:
+                del merged[key]
+        for key, entry in self._index.items():
+            other = merged.get(key)
+            if other is None or entry["last_used"] >= other["last_used"]:
+                merged[key] = entry
+        return merged
+
+    def _save(self):
+        """Re-read, merge, evict and write the index under the lock file."""
+        os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+        with open(f"{self.index_path}.lock", "w") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self._index = self._merge(self._read_disk())
+                self._evict()
+
+                tmp_path = f"{self.index_path}.{os.getpid()}.tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    json.dump(self._index, f)
+                os.replace(tmp_path, self.index_path)
+                self._disk_mtime = self._index_mtime()
+                self._dropped = {}
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _refresh(self):
+        """Pick up entries other workers wrote since we last read / wrote."""
+        if self._index_mtime() != self._disk_mtime:
+            self._index = self._merge(self._read_disk())
+
+    # ---------------- eviction ----------------
+    def _drop(self, key: str):
+        """Forget an entry; the output file is left to the janitor."""
+        if self._index.pop(key, None) is not None:
+            self._dropped[key] = time.time()
+
+    def _evict(self):
+        total = sum(e["size"] for e in self._index.values())
+        if total <= self.max_bytes:
+            return
+        for key in sorted(self._index, key=lambda k: self._index[k]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= self._index[key]["size"]
+            self._drop(key)
+            metrics.incr("result_cache.evictions")
+
+    # ---------------- public API ----------------
+    def get(self, key: str, operation: str = "unknown"):
+        """
+        Cached output key or None.
+        """
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self._refresh()
+                entry = self._index.get(key)
+            if entry is not None:
+                expired = time.time() - entry["created"] > self.ttl
+                missing = not self.storage.exists(entry["filename"])
+                if expired or missing:
+                    self._drop(key)
+                    try:
+                        self._save()
+                    except OSError as e:
+                        print(f"[WARN] Could not persist result cache index: {e}")
+                    entry = None
+
+            if entry is None:
+                metrics.incr("result_cache.misses")
+                metrics.incr(f"result_cache.misses.{operation}")
+                return None
+
+            entry["last_used"] = time.time()
+            metrics.incr("result_cache.hits")
+            metrics.incr(f"result_cache.hits.{operation}")
+            return entry["filename"]
+
+    def put(self, key: str, filename: str, operation: str = "unknown"):
+        if not self.enabled:
+            return
+
+        try:
+            size = self.storage.size(filename)
+        except (OSError, ValueError):
+            return
+
+        now = time.time()
+        with self._lock:
+            self._index[key] = {
+                "filename": filename,
+                "size": size,
+                "created": now,
+                "last_used": now,
+                "operation": operation,
+            }
+            try:
+                self._save()
+            except OSError as e:
+                print(f"[WARN] Could not persist result cache index: {e}")
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._index),
+                "bytes": sum(e["size"] for e in self._index.values()),
+                "max_bytes": self.max_bytes,
+            }
+
+
+result_cache = ResultCache(
+    output_storage,
+    RESULT_CACHE_INDEX,
+    max_bytes=RESULT_CACHE_MAX_MB * 1024 * 1024,
+    ttl=RESULT_CACHE_TTL_SECONDS,
+    enabled=RESULT_CACHE_ENABLED
+)
@@ -0,0 +1,140 @@
+import time
+import cv2
+from modules.common_sam import (
+    checkout_predictor, set_image_cached, make_proxy, detect,
+    box_to_xyxy, predict_mask
+)
+from modules.seg_pool import seg_pool
+from modules.storage import output_storage
+from modules.image_io import decode_upload, encode_image, save_debug
+from modules.payloads import prepare
+from modules.compositing import feather_mask, exclusive_alpha, composite
+from modules.texture_map import map_texture, parse_tiles_across
+from modules.seam_quality import SeamMeter, resolve_mode, should_refine, record_refine
+from modules.ai_clients import GEMINI_IMAGE
+
+# One DINO pass for both surfaces; boxes are split back out by phrase.
+ROOM_CAPTION = "wall . floor . flooring . ground"
+WALL_PHRASES = ("wall",)
+FLOOR_PHRASES = ("floor", "flooring", "ground")
+
+# Same per-surface thresholds as replace_wall / replace_floor
+WALL_BOX_THRESHOLD = 0.32
+FLOOR_BOX_THRESHOLD = 0.30
+TEXT_THRESHOLD = 0.25
+
+
+def split_boxes(boxes, logits, phrases):
+    """
+    Pick the best-scoring wall box and floor box from a merged-caption
+    DINO prediction. Returns (wall_box, floor_box); either may be None.
+    """
+    best = {"wall": (None, -1.0), "floor": (None, -1.0)}
+
+    for box, score, phrase in zip(boxes, logits.tolist(), phrases):
+        phrase = phrase.lower()
+        if any(p in phrase for p in FLOOR_PHRASES):
+            kind, threshold = "floor", FLOOR_BOX_THRESHOLD
+        elif any(p in phrase for p in WALL_PHRASES):
+            kind, threshold = "wall", WALL_BOX_THRESHOLD
+        else:
+            continue
+
+        if score >= threshold and score > best[kind][1]:
+            best[kind] = (box, score)
+
+    return best["wall"][0], best["floor"][0]
+
+
+def compose_room(image_bgr, wall_swatch, floor_swatch, tiles_across=None):
+    """
+    Detect + segment wall and floor, map both swatches and blend them
+    into image_bgr in place. Returns the seam score. Runs in the
+    segmentation pool (modules/seg_pool.py) or inline.
+    """
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    h, w, _ = image_rgb.shape
+
+    # Detection + segmentation run on a bounded-size proxy
+    proxy = make_proxy(image_rgb)
+    ph, pw = proxy.shape[:2]
+
+    boxes, logits, phrases = detect(
+        proxy,
+        ROOM_CAPTION,
+        box_threshold=min(WALL_BOX_THRESHOLD, FLOOR_BOX_THRESHOLD),
+        text_threshold=TEXT_THRESHOLD
+    )
+
+    wall_box, floor_box = split_boxes(boxes, logits, phrases)
+
+    if wall_box is None:
+        raise RuntimeError("No wall detected")
+    if floor_box is None:
+        raise RuntimeError("No floor detected")
+
+    # ---------------- ONE SAM ENCODE, TWO MASKS ----------------
+    with checkout_predictor() as sam_predictor:
+        set_image_cached(sam_predictor, proxy)
+        wall_mask = predict_mask(sam_predictor, box_to_xyxy(wall_box, pw, ph), (h, w))
+        floor_mask = predict_mask(sam_predictor, box_to_xyxy(floor_box, pw, ph), (h, w))
+
+    # Wall boxes usually include some floor; floor wins on overlap
+    wall_mask = wall_mask & ~floor_mask
+
+    wall_tex = map_texture("wall", wall_swatch, wall_mask, tiles_across)
+    floor_tex = map_texture("floor", floor_swatch, floor_mask, tiles_across)
+
+    # ---------------- SINGLE BLEND ----------------
+    floor_alpha = feather_mask(floor_mask, 25)
+    wall_alpha = exclusive_alpha(feather_mask(wall_mask, 21), floor_alpha)
+
+    # Measured against the original, so build before compositing in place
+    meters = [SeamMeter(image_bgr, wall_mask), SeamMeter(image_bgr, floor_mask)]
+
+    composite(
+        image_bgr,
+        [(wall_tex, wall_alpha), (floor_tex, floor_alpha)],
+        out=image_bgr
+    )
+    return max(m.score(image_bgr) for m in meters)
+
+
+def restyle_room(request):
+    tiles_across = parse_tiles_across(request.form.get("tiles_across"))
+    image_bgr = decode_upload(request.files["target_image"])
+    wall_swatch = decode_upload(request.files["wall_image"])
+    floor_swatch = decode_upload(request.files["floor_image"])
+
+    # DINO + SAM + mapping + blend run in the segmentation pool (or inline)
+    blended, seam = seg_pool.restyle_room(image_bgr, wall_swatch, floor_swatch, tiles_across)
+
+    save_debug("sam_room", blended)
+
+    # Gemini seam cleanup only when the local composite needs it
+    mode = resolve_mode(request.form.get("refine"))
+    if not should_refine("room", mode, seam):
+        return output_storage.save(encode_image(blended, ".png"), "final_room", ".png")
+
+    blended_payload = prepare(blended, "lossless")
+    t0 = time.time()
+
+    response = GEMINI_IMAGE.generate_content([
+        {
+            "role": "user",
+            "parts": [
+                {"text": "Remove seams between wall and floor, preserve shadows, make the room realistic."},
+                {
+                    "inline_data": blended_payload
+                }
+            ]
+        }
+    ])
+    record_refine("room", time.time() - t0)
+
+    for c in response.candidates:
+        for p in c.content.parts:
+            if p.inline_data:
+                return output_storage.save(p.inline_data.data, "final_room", ".png")
+
+    raise RuntimeError("Gemini failed")
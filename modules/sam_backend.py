@@ -0,0 +1,215 @@
+"""
+sam_backend.py
+---------------------------------
+Selectable CPU inference backend for GroundingDINO + SAM.
+
+SEGMENT_BACKEND=fp32   eager fp32 PyTorch (default, previous behaviour)
+SEGMENT_BACKEND=int8   dynamic int8 quantization of all nn.Linear layers
+SAM_TRACE_ENCODER=1    TorchScript-trace (+ freeze) the SAM image encoder
+TORCH_NUM_THREADS=N    intra-op thread count (torch.set_num_threads)
+
+Accuracy check against the fp32 baseline (mask IoU):
+    python -m modules.sam_backend room1.jpg room2.jpg --caption wall
+"""
+
+import os
+import sys
+import time
+import argparse
+import torch
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+SEGMENT_BACKEND = os.getenv("SEGMENT_BACKEND", "fp32").lower()
+SAM_TRACE_ENCODER = os.getenv("SAM_TRACE_ENCODER", "0") == "1"
+TORCH_NUM_THREADS = int(os.getenv("TORCH_NUM_THREADS", "0"))  # 0 = torch default
+
+BACKENDS = ("fp32", "int8")
+
+if SEGMENT_BACKEND not in BACKENDS:
+    raise RuntimeError(
+        f"❌ SEGMENT_BACKEND must be one of {BACKENDS}, got {SEGMENT_BACKEND!r}"
+    )
+
+
+def backend_name(backend: str = SEGMENT_BACKEND, trace: bool = SAM_TRACE_ENCODER) -> str:
+    """
+    Identifies the numeric behaviour of the loaded models (used in cache keys).
+    """
+    return f"{backend}{'+traced' if trace else ''}"
+
+
+def configure_threads(num_threads: int = TORCH_NUM_THREADS):
+    if num_threads > 0:
+        torch.set_num_threads(num_threads)
+
+
+# =========================================================
+# 🔹 MODEL OPTIMIZATION
+# =========================================================
+def quantize_linear(model):
+    return torch.quantization.quantize_dynamic(
+        model, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+class TracedImageEncoder(torch.nn.Module):
+    """
+    TorchScript encoder that still exposes .img_size, which SamPredictor
+    and Sam.preprocess read from model.image_encoder.
+    """
+
+    def __init__(self, traced, img_size: int):
+        super().__init__()
+        self.traced = traced
+        self.img_size = img_size
+
+    def forward(self, x):
+        return self.traced(x)
+
+
+def trace_image_encoder(encoder):
+    img_size = encoder.img_size
+    example = torch.zeros(1, 3, img_size, img_size)
+
+    t0 = time.time()
+    with torch.no_grad():
+        traced = torch.jit.trace(encoder.eval(), example)
+        traced = torch.jit.freeze(traced)
+    print(f"🔹 Traced SAM image encoder in {time.time() - t0:.1f}s")
+
+    return TracedImageEncoder(traced, img_size)
+
+
+def optimize_dino(model, backend: str = SEGMENT_BACKEND):
+    model.eval()
+    if backend == "int8":
+        model = quantize_linear(model)
+    return model
+
+
+def optimize_sam(sam, backend: str = SEGMENT_BACKEND, trace: bool = SAM_TRACE_ENCODER):
+    sam.eval()
+    if backend == "int8":
+        sam.image_encoder = quantize_linear(sam.image_encoder)
+    if trace:
+        sam.image_encoder = trace_image_encoder(sam.image_encoder)
+    return sam
+
+
+# =========================================================
+# 🔹 ACCURACY CHECK (MASK IoU VS FP32)
+# =========================================================
+def mask_iou(a, b) -> float:
+    union = (a | b).sum()
+    if union == 0:
+        return 1.0
+    return float((a & b).sum() / union)
+
+
+def _segment(dino, predictor, image_path, caption, box_threshold, text_threshold):
+    import numpy as np
+    from groundingdino.util.inference import predict, load_image
+
+    image_rgb, image_tensor = load_image(image_path)
+    h, w, _ = image_rgb.shape
+
+    boxes, _, _ = predict(
+        model=dino,
+        image=image_tensor,
+        caption=caption,
+        box_threshold=box_threshold,
+        text_threshold=text_threshold,
+        device="cpu"
+    )
+    if len(boxes) == 0:
+        return None, 0.0
+
+    box = boxes[0] * torch.tensor([w, h, w, h])
+    x_c, y_c, bw, bh = box.tolist()
+    input_box = np.array([
+        int(x_c - bw / 2),
+        int(y_c - bh / 2),
+        int(x_c + bw / 2),
+        int(y_c + bh / 2)
+    ])
+
+    t0 = time.time()
+    predictor.set_image(image_rgb)
+    encode_s = time.time() - t0
+
+    mask = predictor.predict(box=input_box, multimask_output=False)[0][0]
+    return mask, encode_s
+
+
+def check_accuracy(image_paths, caption="wall", backend=SEGMENT_BACKEND,
+                   trace=SAM_TRACE_ENCODER, box_threshold=0.30, text_threshold=0.25):
+    """
+    Segment each image with fp32 eager models and with the candidate
+    backend; return per-image mask IoU and SAM encode times.
+    """
+    from groundingdino.util.inference import load_model
+    from segment_anything import sam_model_registry, SamPredictor
+    from modules import common_sam
+
+    def build(candidate_backend, candidate_trace):
+        common_sam.download_if_missing(common_sam.DINO_CHECKPOINT, common_sam.DINO_URL, min_size_mb=600)
+        common_sam.download_if_missing(common_sam.SAM_CHECKPOINT, common_sam.SAM_URL, min_size_mb=300)
+        dino = load_model(common_sam.DINO_CONFIG, common_sam.DINO_CHECKPOINT, device="cpu")
+        sam = sam_model_registry["vit_b"](checkpoint=common_sam.SAM_CHECKPOINT)
+        dino = optimize_dino(dino, candidate_backend)
+        sam = optimize_sam(sam, candidate_backend, candidate_trace)
+        return dino, SamPredictor(sam)
+
+    configure_threads()
+    base_dino, base_predictor = build("fp32", False)
+    cand_dino, cand_predictor = build(backend, trace)
+
+    results = []
+    for path in image_paths:
+        base_mask, base_s = _segment(base_dino, base_predictor, path, caption, box_threshold, text_threshold)
+        cand_mask, cand_s = _segment(cand_dino, cand_predictor, path, caption, box_threshold, text_threshold)
+
+        if base_mask is None or cand_mask is None:
+            iou = 1.0 if base_mask is None and cand_mask is None else 0.0
+        else:
+            iou = mask_iou(base_mask, cand_mask)
+
+        results.append({
+            "image": path,
+            "iou": iou,
+            "fp32_encode_s": base_s,
+            "candidate_encode_s": cand_s,
+        })
+
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Compare segmentation masks of a backend against fp32."
+    )
+    parser.add_argument("images", nargs="+")
+    parser.add_argument("--caption", default="wall")
+    parser.add_argument("--backend", default=SEGMENT_BACKEND, choices=BACKENDS)
+    parser.add_argument("--trace", action="store_true", default=SAM_TRACE_ENCODER)
+    parser.add_argument("--min-iou", type=float, default=0.95)
+    args = parser.parse_args(argv)
+
+    results = check_accuracy(args.images, args.caption, args.backend, args.trace)
+
+    for r in results:
+        print(
+            f"{r['image']}: IoU={r['iou']:.4f} "
+            f"encode fp32={r['fp32_encode_s']:.2f}s "
+            f"{backend_name(args.backend, args.trace)}={r['candidate_encode_s']:.2f}s"
+        )
+
+    mean_iou = sum(r["iou"] for r in results) / len(results)
+    print(f"Mean IoU: {mean_iou:.4f} (min required {args.min_iou})")
+    return 0 if mean_iou >= args.min_iou else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
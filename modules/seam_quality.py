@@ -0,0 +1,139 @@
+"""
+seam_quality.py
+---------------------------------
+Local seam score + gating for the Gemini "remove seams" pass.
+
+The score compares edge energy (|Laplacian|) in a thin band along the
+mask boundary of the composite against what that band should look like:
+
+    expected = max(original band energy,
+                   mean of the composite's energy just inside / outside)
+    score    = composite band energy / expected
+
+~1.0 means the boundary is no edgier than the photo or the texture
+already were; a visible seam (halo, hard cut, highlight line) pushes
+it up. A feathered tone change between the new texture and the scene is
+expected and scores low. Everything runs on a <= SEAM_MAX_SIDE proxy.
+
+Refine modes (REFINE_MODE env default, per-request "refine" form field):
+  none    never call Gemini, return the local composite
+  auto    call Gemini only when score >= REFINE_SEAM_THRESHOLD
+  always  old behaviour
+"""
+
+import os
+import threading
+import cv2
+import numpy as np
+from modules.metrics import incr, gauge, observe
+
+REFINE_MODES = ("none", "auto", "always")
+REFINE_MODE = os.getenv("REFINE_MODE", "auto").lower()
+REFINE_SEAM_THRESHOLD = float(os.getenv("REFINE_SEAM_THRESHOLD", "2.0"))
+SEAM_MAX_SIDE = int(os.getenv("SEAM_MAX_SIDE", "768"))
+# |Laplacian| below this is invisible; keeps flat scenes from scoring
+# a tiny absolute edge as a huge ratio
+SEAM_ENERGY_FLOOR = float(os.getenv("SEAM_ENERGY_FLOOR", "4"))
+# Assumed refine latency until a real call has been measured
+REFINE_LATENCY_PRIOR = float(os.getenv("REFINE_LATENCY_PRIOR", "8"))
+
+if REFINE_MODE not in REFINE_MODES:
+    raise RuntimeError(f"❌ REFINE_MODE must be one of {REFINE_MODES}, got {REFINE_MODE!r}")
+
+
+def _proxy(image, interp):
+    h, w = image.shape[:2]
+    scale = SEAM_MAX_SIDE / max(h, w)
+    if scale >= 1:
+        return image
+    size = (max(1, round(w * scale)), max(1, round(h * scale)))
+    return cv2.resize(image, size, interpolation=interp)
+
+
+def _edge_energy(image_bgr):
+    """
+    |Laplacian| of the gray proxy: high on hard cuts, thin highlight
+    lines and halos, low on a properly feathered tone change (which is
+    the intended result of putting a new texture next to the old scene).
+    """
+    gray = cv2.cvtColor(_proxy(image_bgr, cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+    return np.abs(cv2.Laplacian(gray.astype(np.float32), cv2.CV_32F, ksize=3))
+
+
+class SeamMeter:
+    """
+    Build from the original image + mask *before* compositing (the
+    composite is usually written in place), then score() the result.
+    """
+
+    def __init__(self, image_bgr, mask, band_px: int = 3):
+        m = _proxy(mask.astype(np.uint8), cv2.INTER_NEAREST)
+        k = np.ones((3, 3), np.uint8)
+        outer = cv2.dilate(m, k, iterations=band_px)
+        inner = cv2.erode(m, k, iterations=band_px)
+        self.band = (outer != inner)
+        self.inside = (inner != cv2.erode(m, k, iterations=3 * band_px))
+        self.outside = (cv2.dilate(m, k, iterations=3 * band_px) != outer)
+
+        self.original = self._mean(_edge_energy(image_bgr), self.band)
+
+    @staticmethod
+    def _mean(grad, region):
+        return float(grad[region].mean()) if region.any() else 0.0
+
+    def score(self, composite_bgr) -> float:
+        if not self.band.any():
+            return 0.0
+        grad = _edge_energy(composite_bgr)
+        expected = max(
+            self.original,
+            0.5 * (self._mean(grad, self.inside) + self._mean(grad, self.outside)),
+            SEAM_ENERGY_FLOOR
+        )
+        return self._mean(grad, self.band) / expected
+
+
+def seam_score(original_bgr, composite_bgr, mask, band_px: int = 3) -> float:
+    return SeamMeter(original_bgr, mask, band_px).score(composite_bgr)
+
+
+# =========================================================
+# 🔹 GATING + METRICS
+# =========================================================
+_latency = {}
+_latency_lock = threading.Lock()
+
+
+def resolve_mode(value) -> str:
+    value = (value or REFINE_MODE).lower()
+    return value if value in REFINE_MODES else REFINE_MODE
+
+
+def should_refine(op: str, mode: str, score) -> bool:
+    """Decide, and count the decision under refine.<op>.*"""
+    if score is not None:
+        gauge(f"refine.{op}.last_score", round(score, 3))
+
+    if mode == "always":
+        run = True
+    elif mode == "none":
+        run = False
+    else:
+        run = score is None or score >= REFINE_SEAM_THRESHOLD
+
+    if run:
+        incr(f"refine.{op}.refined")
+    else:
+        incr(f"refine.{op}.skipped")
+        with _latency_lock:
+            saved = _latency.get(op, REFINE_LATENCY_PRIOR)
+        incr(f"refine.{op}.latency_saved_s", saved)
+    return run
+
+
+def record_refine(op: str, seconds: float):
+    """Feed the measured Gemini refine latency (EWMA) used for savings."""
+    observe(f"refine.{op}", seconds)
+    with _latency_lock:
+        prev = _latency.get(op)
+        _latency[op] = seconds if prev is None else 0.8 * prev + 0.2 * seconds
@@ -0,0 +1,333 @@
+"""
+seg_pool.py
+---------------------------------
+Process pool for the CPU-bound segmentation + compositing work (wall,
+floor and room restyles, multicolor product-mask + k-means detection).
+
+DINO / SAM / OpenCV in the request thread hold the web worker's GIL and
+starve light routes. With SEG_POOL_WORKERS > 0 that work runs in
+separate processes instead:
+
+  - each worker loads the models once (initializer), not per task
+  - images travel through multiprocessing.shared_memory: the web side
+    copies the array into a block once, the worker maps it as an ndarray
+    and writes the composite back into a block it shares with the caller;
+    only names, shapes and scalars are pickled
+  - at most SEG_POOL_QUEUE_LIMIT tasks may be in flight; past that
+    submit raises SegmentationBusyError (-> HTTP 503) instead of queueing
+    without bound. A task that times out keeps its slot (and its shared
+    blocks) until the worker actually finishes it
+  - a worker that dies (e.g. OOM) breaks the executor; it is dropped and
+    the next task gets a fresh one
+
+SEG_POOL_WORKERS=0 (default) runs the same task functions inline, with no
+queue limit of its own (the SAM predictor pool already bounds it).
+"""
+
+import os
+import atexit
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeout
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from modules.metrics import incr, gauge
+
+SEG_POOL_WORKERS = int(os.getenv("SEG_POOL_WORKERS", "0"))
+SEG_POOL_QUEUE_LIMIT = int(os.getenv("SEG_POOL_QUEUE_LIMIT", str(max(1, SEG_POOL_WORKERS) * 2)))
+SEG_POOL_TIMEOUT = float(os.getenv("SEG_POOL_TIMEOUT", "300"))
+SEG_POOL_WARMUP = os.getenv("SEG_POOL_WARMUP", "1") == "1"
+
+
+class SegmentationBusyError(RuntimeError):
+    """Raised when SEG_POOL_QUEUE_LIMIT tasks are already in flight."""
+
+
+# =========================================================
+# 🔹 SHARED MEMORY HELPERS
+# =========================================================
+def _share(array):
+    """Copy array into a new shared block -> (shm, spec)."""
+    shm = shared_memory.SharedMemory(create=True, size=max(1, array.nbytes))
+    view = np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)
+    view[...] = array
+    return shm, (shm.name, array.shape, array.dtype.str)
+
+
+def _alloc(shape, dtype):
+    dtype = np.dtype(dtype)
+    shm = shared_memory.SharedMemory(create=True, size=max(1, int(np.prod(shape)) * dtype.itemsize))
+    return shm, (shm.name, tuple(shape), dtype.str)
+
+
+def _attach(spec):
+    """Worker side: map a caller-owned block (the caller unlinks it)."""
+    name, shape, dtype = spec
+    # spawn workers share the parent's resource tracker, so the extra
+    # registration on attach is a no-op and unlink() cleans up once
+    shm = shared_memory.SharedMemory(name=name)
+    return shm, np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf)
+
+
+def _release(*blocks):
+    for shm in blocks:
+        shm.close()
+        shm.unlink()
+
+
+# =========================================================
+# 🔹 TASKS (RUN IN THE WORKER, OR INLINE)
+# =========================================================
+def _init_worker(torch_threads: int):
+    # The worker's share of the thread budget has to survive the model
+    # loaders and get_sam_pool(), which would otherwise re-apply the
+    # machine-wide TORCH_NUM_THREADS / cpu_count. The env covers a fresh
+    # import of common_sam (and OpenMP / MKL, read when torch loads);
+    # limit_threads() covers a common_sam the spawn bootstrap already
+    # imported via the parent's __main__.
+    threads = str(torch_threads)
+    for var in ("TORCH_NUM_THREADS", "OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = threads
+    os.environ["SAM_POOL_SIZE"] = "1"
+
+    from modules.common_sam import limit_threads
+    limit_threads(torch_threads)
+    if SEG_POOL_WARMUP:
+        from modules.common_sam import warmup
+        warmup()
+
+
+# Array arguments come first (inputs, then outputs), then scalars
+def task_segment_blend(image_bgr, swatch_bgr, caption, box_threshold,
+                       text_threshold, ksize, surface, tiles_across):
+    """
+    Segment, map the swatch onto the surface, blend into image_bgr in
+    place. Returns the seam score, or None if nothing was detected.
+    """
+    import cv2
+    from modules.common_sam import segment
+    from modules.compositing import blend_texture
+    from modules.texture_map import map_texture
+    from modules.seam_quality import SeamMeter
+
+    image_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
+    mask = segment(image_rgb, caption, box_threshold, text_threshold)
+    if mask is None:
+        return None
+    texture = map_texture(surface, swatch_bgr, mask, tiles_across)
+    meter = SeamMeter(image_bgr, mask)
+    blend_texture(image_bgr, texture, mask, ksize=ksize, out=image_bgr)
+    return meter.score(image_bgr)
+
+
+def task_room(image_bgr, wall_swatch, floor_swatch, tiles_across):
+    """Wall + floor restyle blended into image_bgr in place -> seam score."""
+    from modules.room import compose_room
+    return compose_room(image_bgr, wall_swatch, floor_swatch, tiles_across)
+
+
+def task_detect_colors(proxy_rgb, out_labels):
+    """Product mask + k-means on the proxy; label map into out_labels."""
+    from modules.color_detect import detect_colors
+    colors, label_map = detect_colors(proxy_rgb)
+    out_labels[...] = label_map
+    return colors
+
+
+TASKS = {
+    "segment_blend": task_segment_blend,
+    "room": task_room,
+    "detect_colors": task_detect_colors,
+}
+
+
+def _run_shared(task, specs, args):
+    """Worker entry point: map the shared blocks and run one task."""
+    blocks, arrays = [], []
+    try:
+        for spec in specs:
+            shm, arr = _attach(spec)
+            blocks.append(shm)
+            arrays.append(arr)
+        return TASKS[task](*arrays, *args)
+    finally:
+        # Drop the views before closing the mappings
+        del arrays[:]
+        for shm in blocks:
+            try:
+                shm.close()
+            except BufferError:
+                # A task kept a view alive; the mapping goes with it
+                pass
+
+
+# =========================================================
+# 🔹 POOL (WEB SIDE)
+# =========================================================
+class SegmentationPool:
+    def __init__(self, workers: int, limit: int, timeout: float):
+        self.workers = workers
+        self.limit = limit
+        self.timeout = timeout
+        self._executor = None
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    from modules.common_sam import thread_budget
+                    per_worker = max(1, thread_budget() // self.workers)
+                    print(f"🔹 Segmentation pool: {self.workers} processes x {per_worker} threads")
+                    # spawn: forking a process that already runs torch
+                    # threads can deadlock the child
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn"),
+                        initializer=_init_worker,
+                        initargs=(per_worker,)
+                    )
+                    atexit.register(self._executor.shutdown, wait=False, cancel_futures=True)
+        return self._executor
+
+    def _acquire(self):
+        with self._lock:
+            if self._in_flight >= self.limit:
+                incr("seg_pool.rejected")
+                raise SegmentationBusyError(
+                    f"Segmentation queue full ({self._in_flight}/{self.limit})"
+                )
+            self._in_flight += 1
+            gauge("seg_pool.in_flight", self._in_flight)
+
+    def _release_slot(self):
+        with self._lock:
+            self._in_flight -= 1
+            gauge("seg_pool.in_flight", self._in_flight)
+
+    def _reset_executor(self, executor):
+        """Drop a broken executor so the next task starts a fresh one."""
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+        incr("seg_pool.restarts")
+        print("[WARN] Segmentation worker died, restarting the pool")
+
+    def _submit(self, task, specs, args):
+        """-> (executor, future)"""
+        executor = self._get_executor()
+        try:
+            return executor, executor.submit(_run_shared, task, specs, args)
+        except BrokenProcessPool:
+            # Broken by an earlier task; this one never ran, so retry once
+            self._reset_executor(executor)
+            executor = self._get_executor()
+            return executor, executor.submit(_run_shared, task, specs, args)
+
+    def _run(self, task, inputs, outputs, args, read_back=()):
+        """
+        inputs: arrays copied into shared blocks; outputs: (shape, dtype)
+        of fresh blocks the task fills. Returns (result, arrays) where
+        arrays are the outputs plus the inputs listed in read_back (for
+        tasks that write an input in place).
+        """
+        if self.workers <= 0:
+            outs = [np.zeros(shape, dtype) for shape, dtype in outputs]
+            result = TASKS[task](*inputs, *outs, *args)
+            return result, [inputs[i] for i in read_back] + outs
+
+        self._acquire()
+        blocks = []
+
+        def release(_=None):
+            _release(*blocks)
+            self._release_slot()
+
+        future = None
+        try:
+            specs = []
+            for arr in inputs:
+                shm, spec = _share(np.ascontiguousarray(arr))
+                blocks.append(shm)
+                specs.append(spec)
+            for shape, dtype in outputs:
+                shm, spec = _alloc(shape, dtype)
+                blocks.append(shm)
+                specs.append(spec)
+
+            executor, future = self._submit(task, specs, args)
+            try:
+                result = future.result(timeout=self.timeout)
+            except BrokenProcessPool as e:
+                # Most likely this task killed the worker (OOM); the pool
+                # is rebuilt for the next one, the client may retry
+                self._reset_executor(executor)
+                raise SegmentationBusyError("Segmentation worker died, please retry") from e
+
+            wanted = list(read_back) + list(range(len(inputs), len(specs)))
+            arrays = []
+            for i in wanted:
+                _, shape, dtype = specs[i]
+                arrays.append(np.ndarray(shape, dtype=np.dtype(dtype), buffer=blocks[i].buf).copy())
+            return result, arrays
+        except FutureTimeout:
+            incr("seg_pool.timeouts")
+            raise
+        finally:
+            if future is not None and not future.done():
+                # Timed out: the worker still writes into the blocks and
+                # still occupies a slot until it finishes
+                future.add_done_callback(release)
+            else:
+                release()
+
+    def segment_blend(self, image_bgr, swatch_bgr, caption, box_threshold,
+                      text_threshold, ksize, surface, tiles_across=None):
+        """
+        (composite, seam score), or (None, None) if nothing was detected.
+        The composite is image_bgr itself when inline. The swatch is
+        mapped onto the mask in the worker (modules/texture_map.py), so
+        only the small swatch is shared.
+        """
+        score, (blended,) = self._run(
+            "segment_blend", [image_bgr, swatch_bgr], [],
+            (caption, box_threshold, text_threshold, ksize, surface, tiles_across),
+            read_back=(0,)
+        )
+        if score is None:
+            return None, None
+        return blended, score
+
+    def restyle_room(self, image_bgr, wall_swatch, floor_swatch, tiles_across=None):
+        """(composite, seam score); raises if the wall or floor is missing."""
+        score, (blended,) = self._run(
+            "room", [image_bgr, wall_swatch, floor_swatch], [],
+            (tiles_across,), read_back=(0,)
+        )
+        return blended, score
+
+    def detect_colors(self, image_rgb):
+        """
+        Same contract as color_detect.detect_colors. Only the bounded-size
+        proxy is shared; the label map comes back at proxy resolution.
+        """
+        from modules.common_sam import make_proxy
+        proxy = np.ascontiguousarray(make_proxy(image_rgb))
+        colors, (label_map,) = self._run(
+            "detect_colors", [proxy], [(proxy.shape[:2], np.uint8)], ()
+        )
+        return colors, label_map
+
+    def stats(self):
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "in_flight": self._in_flight,
+                "limit": self.limit,
+            }
+
+
+seg_pool = SegmentationPool(SEG_POOL_WORKERS, SEG_POOL_QUEUE_LIMIT, SEG_POOL_TIMEOUT)
@@ -0,0 +1,323 @@
+"""
+storage.py
+---------------------------------
+Shared output storage for every module.
+
+- Collision-free keys: UUID4 or content hash (sha256), never timestamps
+- Sharded layout: "ab/cd/<prefix>_<id>.<ext>" so no directory gets huge
+- Atomic writes (temp file + rename) on the local backend
+- Pluggable backend:
+    STORAGE_BACKEND=local  static/output, static/tmp (default)
+    STORAGE_BACKEND=s3     any S3-compatible endpoint (MinIO etc.), needs boto3
+
+Keys are what modules return to the templates; use media_url(key) /
+tmp_storage.url(key) to turn them into links.
+"""
+
+import os
+import re
+import uuid
+import hashlib
+import tempfile
+import threading
+import contextvars
+from collections import Counter
+from contextlib import contextmanager
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL")      # e.g. http://localhost:9000
+S3_BUCKET = os.getenv("S3_BUCKET", "product-modification")
+S3_PUBLIC_URL = os.getenv("S3_PUBLIC_URL")          # optional public base URL
+S3_URL_EXPIRES = int(os.getenv("S3_URL_EXPIRES", "86400"))
+
+
+class InvalidKeyError(ValueError):
+    """Raised for keys that could escape the storage root."""
+
+
+def validate_key(key: str) -> str:
+    if not key or key.startswith(("/", "\\")) or "\\" in key:
+        raise InvalidKeyError(f"Invalid storage key: {key!r}")
+    if any(part in ("", ".", "..") for part in key.split("/")):
+        raise InvalidKeyError(f"Invalid storage key: {key!r}")
+    return key
+
+
+def safe_prefix(text: str) -> str:
+    """
+    Make user-supplied text (colors, labels) safe for use in a key.
+    """
+    return re.sub(r"[^A-Za-z0-9_-]+", "_", text).strip("_") or "file"
+
+
+# =========================================================
+# 🔹 BACKENDS
+# =========================================================
+class LocalBackend:
+    def __init__(self, root: str, url_prefix: str):
+        self.root = root
+        self.url_prefix = url_prefix.rstrip("/") + "/"
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root, *validate_key(key).split("/"))
+
+    def write(self, key: str, data: bytes, content_type=None):
+        path = self.path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.chmod(tmp_path, 0o644)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+
+    def read(self, key: str) -> bytes:
+        with open(self.path(key), "rb") as f:
+            return f.read()
+
+    def exists(self, key: str) -> bool:
+        return os.path.isfile(self.path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.path(key))
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self):
+        """
+        Yield (key, size_bytes, mtime) for every stored object.
+        """
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.startswith("."):
+                    continue
+                path = os.path.join(dirpath, name)
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                rel = os.path.relpath(path, self.root).replace(os.sep, "/")
+                yield rel, st.st_size, st.st_mtime
+
+    def url(self, key: str) -> str:
+        return self.url_prefix + validate_key(key)
+
+
+class S3Backend:
+    def __init__(self, bucket: str, prefix: str, endpoint_url=None,
+                 public_url=None, url_expires: int = S3_URL_EXPIRES):
+        try:
+            import boto3
+        except ImportError as e:
+            raise RuntimeError(
+                "❌ STORAGE_BACKEND=s3 requires boto3 (pip install boto3)"
+            ) from e
+
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/"
+        self.public_url = public_url.rstrip("/") if public_url else None
+        self.url_expires = url_expires
+        self.client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def _obj(self, key: str) -> str:
+        return self.prefix + validate_key(key)
+
+    def write(self, key: str, data: bytes, content_type=None):
+        # S3 PUTs are atomic: readers see the old object or the new one
+        extra = {"ContentType": content_type} if content_type else {}
+        self.client.put_object(Bucket=self.bucket, Key=self._obj(key), Body=data, **extra)
+
+    def read(self, key: str) -> bytes:
+        obj = self.client.get_object(Bucket=self.bucket, Key=self._obj(key))
+        return obj["Body"].read()
+
+    def _head(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=self._obj(key))
+        except ClientError:
+            return None
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> int:
+        head = self._head(key)
+        if head is None:
+            raise FileNotFoundError(key)
+        return head["ContentLength"]
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=self._obj(key))
+
+    def list(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                yield (
+                    obj["Key"][len(self.prefix):],
+                    obj["Size"],
+                    obj["LastModified"].timestamp()
+                )
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url}/{self._obj(key)}"
+        return self.client.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": self.bucket, "Key": self._obj(key)},
+            ExpiresIn=self.url_expires
+        )
+
+
+# =========================================================
+# 🔹 STORAGE (NAMING + BACKEND)
+# =========================================================
+CONTENT_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".webp": "image/webp",
+    ".json": "application/json",
+    ".npz": "application/octet-stream",
+}
+
+
+# Keys written, read or checked inside a pin_scope() stay pinned until the
+# scope exits (e.g. for the lifetime of a job), so the janitor never
+# deletes a job's outputs or the inputs it is still working from.
+_pin_scope = contextvars.ContextVar("storage_pin_scope", default=None)
+
+
+@contextmanager
+def pin_scope():
+    pinned = []
+    token = _pin_scope.set(pinned)
+    try:
+        yield pinned
+    finally:
+        _pin_scope.reset(token)
+        for storage, key in pinned:
+            storage.unpin(key)
+
+
+class Storage:
+    def __init__(self, backend):
+        self.backend = backend
+        self._pins = Counter()
+        self._pin_lock = threading.Lock()
+
+    # ---------------- pinning (in-flight keys) ----------------
+    def pin(self, key: str):
+        with self._pin_lock:
+            self._pins[key] += 1
+
+    def unpin(self, key: str):
+        with self._pin_lock:
+            self._pins[key] -= 1
+            if self._pins[key] <= 0:
+                del self._pins[key]
+
+    def is_pinned(self, key: str) -> bool:
+        with self._pin_lock:
+            return key in self._pins
+
+    def _pin_in_scope(self, key: str):
+        scope = _pin_scope.get()
+        if scope is not None and (self, key) not in scope:
+            self.pin(key)
+            scope.append((self, key))
+
+    @contextmanager
+    def pinned(self, key: str):
+        """
+        Protect a key that an in-flight request will read later, outside
+        any pin_scope (e.g. while a streamed response is running).
+        """
+        self.pin(key)
+        try:
+            yield key
+        finally:
+            self.unpin(key)
+
+    @staticmethod
+    def new_key(prefix: str, ext: str, data: bytes = None) -> str:
+        """
+        "ab/cd/<prefix>_<id><ext>" where id is the content hash of data
+        (content-addressed) or a random UUID.
+        """
+        if data is not None:
+            uid = hashlib.sha256(data).hexdigest()[:32]
+        else:
+            uid = uuid.uuid4().hex
+        return f"{uid[:2]}/{uid[2:4]}/{prefix}_{uid}{ext}"
+
+    def save(self, data: bytes, prefix: str, ext: str,
+             content_addressed: bool = False) -> str:
+        key = self.new_key(prefix, ext, data if content_addressed else None)
+
+        self._pin_in_scope(key)
+
+        if content_addressed and self.backend.exists(key):
+            return key
+        self.backend.write(key, data, CONTENT_TYPES.get(ext.lower()))
+        return key
+
+    def read(self, key: str) -> bytes:
+        self._pin_in_scope(key)
+        return self.backend.read(key)
+
+    def exists(self, key: str) -> bool:
+        self._pin_in_scope(key)
+        return self.backend.exists(key)
+
+    def size(self, key: str) -> int:
+        return self.backend.size(key)
+
+    def delete(self, key: str):
+        self.backend.delete(key)
+
+    def list(self):
+        return self.backend.list()
+
+    def url(self, key: str) -> str:
+        return self.backend.url(key)
+
+
+def make_storage(namespace: str) -> Storage:
+    """
+    namespace: "output" -> static/output, "tmp" -> static/tmp
+    """
+    if STORAGE_BACKEND == "s3":
+        return Storage(S3Backend(
+            S3_BUCKET, namespace,
+            endpoint_url=S3_ENDPOINT_URL,
+            public_url=S3_PUBLIC_URL
+        ))
+    if STORAGE_BACKEND == "local":
+        return Storage(LocalBackend(
+            os.path.join("static", namespace),
+            f"/static/{namespace}/"
+        ))
+    raise RuntimeError(f"❌ Unknown STORAGE_BACKEND: {STORAGE_BACKEND}")
+
+
+output_storage = make_storage("output")
+tmp_storage = make_storage("tmp")
@@ -0,0 +1,318 @@
+"""
+texture_map.py
+---------------------------------
+Local texture mapping for wall / floor replacement.
+
+Instead of stretching the swatch over the whole frame with
+cv2.resize(tex, (w, h)), the swatch is tiled at a fixed scale:
+
+  wall   fronto-parallel: the tile repeats across the mask's bounding box,
+         WALL_TILES_ACROSS tiles over its width
+  floor  perspective-correct: a ground-plane homography is estimated from
+         the mask (vanishing point from the mask's side edges when they are
+         not the frame border, otherwise an assumed horizon above the
+         floor), FLOOR_TILES_ACROSS tiles across the bottom of the frame
+
+Tiles repeat via BORDER_WRAP / BORDER_REFLECT inside warpPerspective, so no
+plane-sized canvas is ever built. The tile scale is part of the warp, not
+of the cached image: each swatch gets one mip pyramid (<= TILE_MAX_SIDE,
+cached by content hash, reused by every image and scale) and every
+output row samples the level matching its minification, which also keeps
+far floor rows free of moire.
+
+tiles_across comes from the form and is validated to
+[TILES_ACROSS_MIN, TILES_ACROSS_MAX] (parse_tiles_across).
+"""
+
+import os
+import math
+import threading
+from collections import OrderedDict
+import cv2
+import numpy as np
+from modules.result_cache import content_hash
+from modules.metrics import incr
+
+# "tiled" = this module, "stretch" = old full-frame resize
+TEXTURE_MAPPING = os.getenv("TEXTURE_MAPPING", "tiled").lower()
+# "repeat" keeps the swatch pattern, "mirror" hides non-seamless edges
+TEXTURE_TILE_MODE = os.getenv("TEXTURE_TILE_MODE", "repeat").lower()
+FLOOR_TILES_ACROSS = float(os.getenv("FLOOR_TILES_ACROSS", "4"))
+WALL_TILES_ACROSS = float(os.getenv("WALL_TILES_ACROSS", "3"))
+# Focal length as a fraction of the image width (~53° horizontal FOV)
+FLOOR_FOCAL_RATIO = float(os.getenv("FLOOR_FOCAL_RATIO", "1.0"))
+# Assumed horizon distance above the floor's top edge, as a fraction of
+# the floor's height in the frame, when the mask gives no vanishing point
+FLOOR_HORIZON_GAP = max(0.05, float(os.getenv("FLOOR_HORIZON_GAP", "1.0")))
+TILE_CACHE_ENTRIES = int(os.getenv("TILE_CACHE_ENTRIES", "32"))
+# Swatches are downscaled to this long side before the pyramid is built
+TILE_MAX_SIDE = int(os.getenv("TILE_MAX_SIDE", "1024"))
+
+# Same bounds as the forms' number input
+TILES_ACROSS_MIN = 0.5
+TILES_ACROSS_MAX = 50.0
+
+MIN_TILE_PX = 4
+MAX_LEVELS = 6
+
+_BORDER = {"repeat": cv2.BORDER_WRAP, "mirror": cv2.BORDER_REFLECT}
+
+
+class InvalidTilesAcrossError(ValueError):
+    """tiles_across outside [TILES_ACROSS_MIN, TILES_ACROSS_MAX]."""
+
+
+def parse_tiles_across(value):
+    """Form value -> float, or None for the default. Raises on bad input."""
+    if value is None or str(value).strip() == "":
+        return None
+    try:
+        tiles = float(value)
+    except ValueError:
+        raise InvalidTilesAcrossError(f"tiles_across must be a number, got {value!r}")
+    if not TILES_ACROSS_MIN <= tiles <= TILES_ACROSS_MAX:
+        raise InvalidTilesAcrossError(
+            f"tiles_across must be between {TILES_ACROSS_MIN:g} and {TILES_ACROSS_MAX:g}"
+        )
+    return tiles
+
+
+def _clamp_tiles(tiles_across):
+    return min(max(tiles_across, TILES_ACROSS_MIN), TILES_ACROSS_MAX)
+
+
+# =========================================================
+# 🧱 TILE PYRAMID CACHE
+# =========================================================
+class TileCache:
+    """LRU of mip pyramids keyed by texture content hash."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, texture_bgr):
+        key = content_hash(texture_bgr.tobytes())
+        with self._lock:
+            pyramid = self._entries.get(key)
+            if pyramid is not None:
+                self._entries.move_to_end(key)
+                incr("texture_map.tile_cache.hits")
+                return pyramid
+
+        incr("texture_map.tile_cache.misses")
+        pyramid = build_pyramid(texture_bgr)
+        with self._lock:
+            self._entries[key] = pyramid
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return pyramid
+
+
+def build_pyramid(texture_bgr, max_side: int = TILE_MAX_SIDE):
+    """
+    The swatch at <= max_side (never upscaled), then exact halvings down
+    to MIN_TILE_PX. Level 0 is rounded to a multiple of 2^levels so every
+    level repeats with exactly half the previous period.
+    """
+    h, w = texture_bgr.shape[:2]
+    scale = min(1.0, max_side / max(h, w))
+    tile_w = max(MIN_TILE_PX, w * scale)
+    tile_h = max(MIN_TILE_PX, h * scale)
+
+    n = int(math.log2(min(tile_w, tile_h) / MIN_TILE_PX))
+    n = max(0, min(n, MAX_LEVELS))
+    unit = 2 ** n
+    tile_w = max(unit, int(round(tile_w / unit)) * unit)
+    tile_h = max(unit, int(round(tile_h / unit)) * unit)
+
+    interp = cv2.INTER_AREA if tile_w < w else cv2.INTER_CUBIC
+    levels = [cv2.resize(texture_bgr, (tile_w, tile_h), interpolation=interp)]
+    for _ in range(n):
+        levels.append(cv2.pyrDown(levels[-1]))
+    return levels
+
+
+def _level_for(minify: float, max_level: int) -> int:
+    """Pyramid level for `minify` level-0 tile pixels per output pixel."""
+    return int(np.clip(math.floor(math.log2(max(minify, 1.0))), 0, max_level))
+
+
+tile_cache = TileCache(TILE_CACHE_ENTRIES)
+
+
+# =========================================================
+# 📐 FLOOR PLANE ESTIMATION
+# =========================================================
+def _side_lines(mask, rows):
+    """
+    Fit x = a*y + b to the mask's left and right edges over `rows`,
+    ignoring rows where the edge is the frame border. None if too few.
+    """
+    h, w = mask.shape
+    sub = mask[rows]
+    has = sub.any(1)
+    left = np.where(has, sub.argmax(1), -1)
+    right = np.where(has, w - 1 - sub[:, ::-1].argmax(1), -1)
+
+    fits = []
+    for xs, border in ((left, 0), (right, w - 1)):
+        ok = has & (xs != border)
+        if ok.sum() < max(10, len(rows) // 5):
+            return None
+        fits.append(np.polyfit(rows[ok], xs[ok], 1))
+    return fits
+
+
+def floor_homography(mask):
+    """
+    Returns (H, horizon_y, bottom_y) with H mapping ground-plane pixels
+    (1:1 with the image at bottom_y) to image pixels, or None if the mask
+    is too small to work with.
+    """
+    h, w = mask.shape
+    rows = np.flatnonzero(mask.any(1))
+    if len(rows) < 8:
+        return None
+
+    y_top = float(np.percentile(rows, 2))
+    y_bot = float(h - 1)
+    span = max(y_bot - y_top, 1.0)
+
+    cx = w / 2.0
+    horizon = y_top - FLOOR_HORIZON_GAP * span
+
+    band = rows[rows >= y_top]
+    fits = _side_lines(mask, band)
+    if fits is not None:
+        (al, bl), (ar, br) = fits
+        # Edges must converge upwards (floor narrows into the distance)
+        if ar - al > 1e-3:
+            y_v = (bl - br) / (ar - al)
+            if y_top - 10 * span <= y_v <= y_top - 0.05 * span:
+                horizon = y_v
+                cx = al * y_v + bl
+                incr("texture_map.vanishing_point")
+
+    # Trapezoid: bottom edge spans the frame width at y_bot, sides run
+    # to the vanishing point, top edge at y_top
+    k = (y_top - horizon) / (y_bot - horizon)
+    half = w / 2.0
+    dst = np.float32([
+        [cx - half * k, y_top], [cx + half * k, y_top],
+        [cx + half, y_bot], [cx - half, y_bot],
+    ])
+
+    # Ground depth of that trapezoid in bottom-row pixels:
+    # Z ~ 1 / (y - horizon), world width at the bottom = w * Z_bot / f
+    f = FLOOR_FOCAL_RATIO * w
+    depth = f * ((y_bot - horizon) / (y_top - horizon) - 1.0)
+    src = np.float32([[0, 0], [w, 0], [w, depth], [0, depth]])
+
+    return cv2.getPerspectiveTransform(src, dst), horizon, y_bot
+
+
+# =========================================================
+# 🎨 MAPPING
+# =========================================================
+def _warp_band(tile, H, y0, y1, w, border):
+    shift = np.array([[1, 0, 0], [0, 1, -y0], [0, 0, 1]], np.float64)
+    return cv2.warpPerspective(
+        tile, shift @ H, (w, y1 - y0),
+        flags=cv2.INTER_LINEAR, borderMode=border
+    )
+
+
+def row_levels(H, y_start, h, w, max_level):
+    """Mip level for each image row in [y_start, h); H maps level-0 tile px."""
+    Hinv = np.linalg.inv(H)
+    ys = np.arange(y_start, h + 1, dtype=np.float64)
+    cx = w / 2.0
+
+    def plane(xs):
+        p = Hinv @ np.stack([xs, ys, np.ones_like(ys)])
+        return p[:2] / p[2]
+
+    u0, v0 = plane(np.full_like(ys, cx))
+    u1, _ = plane(np.full_like(ys, cx + 1))
+    minify = np.maximum(np.abs(u1 - u0)[:-1], np.abs(np.diff(v0)))
+    levels = np.floor(np.log2(np.maximum(minify, 1.0)))
+    return np.clip(levels, 0, max_level).astype(int)
+
+
+def _tile_px(span: float, tiles_across: float, h: int, w: int) -> float:
+    """Output width of one tile, at most the frame's long side."""
+    return min(span / _clamp_tiles(tiles_across), max(h, w))
+
+
+def map_floor(texture_bgr, mask, tiles_across: float = FLOOR_TILES_ACROSS,
+              mode: str = TEXTURE_TILE_MODE):
+    """Full-frame BGR layer with the swatch tiled on the floor plane."""
+    h, w = mask.shape
+    geometry = floor_homography(mask)
+    if geometry is None:
+        return map_wall(texture_bgr, mask, tiles_across, mode)
+    H, horizon, y_bot = geometry
+
+    pyramid = tile_cache.get(texture_bgr)
+    border = _BORDER.get(mode, cv2.BORDER_WRAP)
+
+    # Level-0 tile px -> ground-plane px (1:1 with the image's bottom row)
+    plane_per_tile = _tile_px(w, tiles_across, h, w) / pyramid[0].shape[1]
+    H_tile = H @ np.diag([plane_per_tile, plane_per_tile, 1.0])
+
+    layer = np.empty((h, w, 3), np.uint8)
+    y_start = min(h, max(0, int(math.floor(horizon)) + 1))
+    layer[:y_start] = pyramid[-1].reshape(-1, 3).mean(0)
+
+    # Pick a pyramid level per row from how many tile pixels one image
+    # pixel spans there (the larger of the horizontal and the much
+    # stronger vertical foreshortening), then warp each run of rows once
+    levels = row_levels(H_tile, y_start, h, w, len(pyramid) - 1)
+    y0 = y_start
+    while y0 < h:
+        level = levels[y0 - y_start]
+        y1 = y0 + 1
+        while y1 < h and levels[y1 - y_start] == level:
+            y1 += 1
+        scale = np.diag([2.0 ** level, 2.0 ** level, 1.0])
+        layer[y0:y1] = _warp_band(pyramid[level], H_tile @ scale, y0, y1, w, border)
+        y0 = y1
+
+    return layer
+
+
+def map_wall(texture_bgr, mask, tiles_across: float = WALL_TILES_ACROSS,
+             mode: str = TEXTURE_TILE_MODE):
+    """Full-frame BGR layer with the swatch tiled over the mask's bbox."""
+    h, w = mask.shape
+    x, y, bw, bh = cv2.boundingRect(mask.astype(np.uint8))
+    if bw == 0:
+        x, y, bw = 0, 0, w
+
+    pyramid = tile_cache.get(texture_bgr)
+    minify = pyramid[0].shape[1] / _tile_px(bw, tiles_across, h, w)
+    level = _level_for(minify, len(pyramid) - 1)
+    s = minify / 2.0 ** level
+
+    # Inverse map: output (x, y) samples tile ((x - x0) * s, (y - y0) * s)
+    M = np.float32([[s, 0, -x * s], [0, s, -y * s]])
+    return cv2.warpAffine(
+        pyramid[level], M, (w, h),
+        flags=cv2.INTER_LINEAR | cv2.WARP_INVERSE_MAP,
+        borderMode=_BORDER.get(mode, cv2.BORDER_WRAP)
+    )
+
+
+def map_texture(surface: str, texture_bgr, mask, tiles_across: float = None):
+    """
+    surface: "floor" | "wall". With TEXTURE_MAPPING=stretch this is the
+    old full-frame resize. tiles_across is clamped to the valid range.
+    """
+    h, w = mask.shape
+    if TEXTURE_MAPPING == "stretch":
+        return cv2.resize(texture_bgr, (w, h))
+    if surface == "floor":
+        return map_floor(texture_bgr, mask, tiles_across or FLOOR_TILES_ACROSS)
+    return map_wall(texture_bgr, mask, tiles_across or WALL_TILES_ACROSS)
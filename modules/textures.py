@@ -0,0 +1,125 @@
+"""
+textures.py
+---------------------------------
+Preloaded fabric swatch registry.
+
+All swatches are decoded once, downscaled to the size the image model
+actually uses and kept JPEG-encoded in memory as ready-to-send Gemini
+parts. A background watcher reloads them when the texture directory
+changes, so requests never touch the disk for a swatch.
+"""
+
+import os
+import time
+import threading
+from io import BytesIO
+from PIL import Image
+from modules.payloads import PROFILES
+
+# =========================================================
+# 🔹 CONFIG
+# =========================================================
+# Defaults follow the "reference" payload profile
+TEXTURE_MAX_SIDE = int(os.getenv("TEXTURE_MAX_SIDE", str(PROFILES["reference"]["max_side"])))
+TEXTURE_JPEG_QUALITY = int(os.getenv("TEXTURE_JPEG_QUALITY", str(PROFILES["reference"]["quality"])))
+# Seconds between directory checks (0 disables hot reload)
+TEXTURE_RELOAD_INTERVAL = float(os.getenv("TEXTURE_RELOAD_INTERVAL", "30"))
+
+
+def encode_swatch(path: str, max_side: int, quality: int) -> dict:
+    img = Image.open(path).convert("RGB")
+    img.thumbnail((max_side, max_side), Image.LANCZOS)
+
+    buf = BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return {"mime_type": "image/jpeg", "data": buf.getvalue()}
+
+
+class TextureRegistry:
+    """
+    name -> encoded swatch payload, loaded up front.
+    """
+
+    def __init__(self, texture_dir: str, name_map: dict,
+                 max_side: int = TEXTURE_MAX_SIDE,
+                 quality: int = TEXTURE_JPEG_QUALITY,
+                 reload_interval: float = TEXTURE_RELOAD_INTERVAL):
+        self.texture_dir = texture_dir
+        self.name_map = dict(name_map)
+        self.max_side = max_side
+        self.quality = quality
+        self.reload_interval = reload_interval
+        self._payloads = {}
+        self._signature = None
+        self._lock = threading.Lock()
+        self._watcher_pid = None
+
+        self.load()
+
+    # ---------------- loading ----------------
+    def _dir_signature(self):
+        sig = []
+        try:
+            for entry in os.scandir(self.texture_dir):
+                st = entry.stat()
+                sig.append((entry.name, st.st_mtime_ns, st.st_size))
+        except FileNotFoundError:
+            return None
+        return tuple(sorted(sig))
+
+    def load(self):
+        t0 = time.time()
+        signature = self._dir_signature()
+        payloads = {}
+
+        for name, filename in self.name_map.items():
+            path = os.path.join(self.texture_dir, filename)
+            if not os.path.exists(path):
+                print(f"[WARN] Missing fabric image: {path}")
+                continue
+            try:
+                payloads[name] = encode_swatch(path, self.max_side, self.quality)
+            except Exception as e:
+                print(f"[WARN] Could not load fabric image {path}: {e}")
+
+        with self._lock:
+            self._payloads = payloads
+            self._signature = signature
+
+        print(f"🔹 Loaded {len(payloads)} fabric textures in {time.time() - t0:.2f}s")
+
+    # ---------------- hot reload ----------------
+    def _watch(self):
+        while True:
+            time.sleep(self.reload_interval)
+            try:
+                if self._dir_signature() != self._signature:
+                    print("🔹 Texture directory changed, reloading")
+                    self.load()
+            except Exception as e:
+                print(f"[WARN] Texture reload failed: {e}")
+
+    def _ensure_watcher(self):
+        # Threads do not survive fork, so start (once) per worker process
+        if self.reload_interval <= 0 or self._watcher_pid == os.getpid():
+            return
+        with self._lock:
+            if self._watcher_pid == os.getpid():
+                return
+            self._watcher_pid = os.getpid()
+        threading.Thread(
+            target=self._watch,
+            name="texture-watcher",
+            daemon=True
+        ).start()
+
+    # ---------------- lookup ----------------
+    def get(self, name: str):
+        """
+        Encoded swatch payload ({"mime_type", "data"}) or None.
+        """
+        self._ensure_watcher()
+        return self._payloads.get(name)
+
+    def names(self):
+        return list(self._payloads)
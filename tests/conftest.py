@@ -0,0 +1,46 @@
+"""
+Shared test setup: dummy API keys, local-only color paths, and a stand-in
+for modules.common_sam when torch / GroundingDINO are not installed (the
+code under test never segments).
+"""
+
+import os
+import sys
+import types
+
+import cv2
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("GEMINI_API_KEY", "test")
+os.environ["MULTICOLOR_DETECTOR"] = "local"
+os.environ["MULTICOLOR_USE_SAM"] = "0"
+os.environ["RECOLOR_MODE"] = "local"
+
+
+def _fake_common_sam():
+    def unused(*args, **kwargs):
+        raise AssertionError("segmentation must not run on the local path")
+
+    def make_proxy(image_rgb, max_side=1024):
+        h, w = image_rgb.shape[:2]
+        scale = max_side / max(h, w)
+        if scale >= 1:
+            return image_rgb
+        return cv2.resize(image_rgb, (round(w * scale), round(h * scale)),
+                          interpolation=cv2.INTER_AREA)
+
+    mod = types.ModuleType("modules.common_sam")
+    mod.make_proxy = make_proxy
+    for name in ("checkout_predictor", "set_image_cached", "detect",
+                 "box_to_xyxy", "predict_mask"):
+        setattr(mod, name, unused)
+    return mod
+
+
+if "torch" not in sys.modules:
+    try:
+        import torch  # noqa: F401
+    except ImportError:
+        sys.modules["modules.common_sam"] = _fake_common_sam()
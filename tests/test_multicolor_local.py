@@ -0,0 +1,94 @@
+"""
+End-to-end run of the local multicolor path: detect colors (k-means,
+no SAM) -> persist the analysis -> modify_detected_color with
+RECOLOR_MODE=local, then a second identical request served from the
+result cache.
+
+The segmentation stack is not needed by this path (see conftest.py);
+storage and the result cache point at a temp dir.
+"""
+
+from io import BytesIO
+
+import cv2
+import numpy as np
+import pytest
+from werkzeug.datastructures import FileStorage, MultiDict
+
+from modules import multicolor, color_detect
+from modules.storage import Storage, LocalBackend
+from modules.result_cache import ResultCache
+
+
+class FakeRequest:
+    def __init__(self, form=None, files=None):
+        self.form = MultiDict(form or {})
+        self.files = MultiDict(files or {})
+
+
+def two_tone_product():
+    """Gray background, red top half / blue bottom half with shading."""
+    img = np.full((240, 320, 3), 235, np.uint8)
+    shade = np.linspace(0.8, 1.0, 240)[40:200, None, None]
+    img[40:120, 60:260] = (np.array([200, 30, 30]) * shade[:80]).astype(np.uint8)
+    img[120:200, 60:260] = (np.array([40, 90, 200]) * shade[80:]).astype(np.uint8)
+    return img
+
+
+@pytest.fixture
+def local_env(tmp_path, monkeypatch):
+    storage = Storage(LocalBackend(str(tmp_path / "output"), "/static/output/"))
+    cache = ResultCache(storage, str(tmp_path / "cache" / "index.json"),
+                        max_bytes=1 << 30, ttl=3600)
+    monkeypatch.setattr(multicolor, "output_storage", storage)
+    monkeypatch.setattr(multicolor, "result_cache", cache)
+    monkeypatch.setattr(color_detect, "output_storage", storage)
+
+    def no_gemini(*args, **kwargs):
+        raise AssertionError("Gemini must not be called on the local path")
+
+    monkeypatch.setattr(multicolor, "modify_gemini", no_gemini)
+    monkeypatch.setattr(multicolor, "refine_seams", no_gemini)
+    return storage
+
+
+def test_detect_then_recolor_locally(local_env):
+    storage = local_env
+    rgb = two_tone_product()
+    ok, jpg = cv2.imencode(".jpg", cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR))
+    assert ok
+
+    upload = FileStorage(BytesIO(jpg.tobytes()), filename="product.jpg")
+    colors, filename, analysis_key, _ = multicolor.detect_multicolors(
+        FakeRequest(files={"multicolor_image": upload})
+    )
+
+    names = [c["name"] for c in colors]
+    assert "Red" in names and "Blue" in names
+    assert analysis_key is not None
+
+    form = {
+        "source_color": "Red",
+        "target_color": "Green",
+        "filename": filename,
+        "analysis": analysis_key,
+        "refine": "0",
+    }
+    out_key, _ = multicolor.modify_detected_color(FakeRequest(form=form))
+    assert out_key is not None and storage.exists(out_key)
+
+    out = cv2.imdecode(np.frombuffer(storage.read(out_key), np.uint8), cv2.IMREAD_COLOR)
+    out_rgb = cv2.cvtColor(out, cv2.COLOR_BGR2RGB).astype(int)
+
+    red_part = out_rgb[60:100, 100:220].reshape(-1, 3).mean(0)
+    blue_part = out_rgb[140:180, 100:220].reshape(-1, 3).mean(0)
+    background = out_rgb[5:30, 5:300].reshape(-1, 3).mean(0)
+
+    # Red became green; blue and the background were left alone
+    assert red_part[1] > red_part[0] + 40
+    assert blue_part[2] > blue_part[0] + 80
+    assert np.all(np.abs(background - 235) < 8)
+
+    # Same request again is a result cache hit
+    again, _ = multicolor.modify_detected_color(FakeRequest(form=form))
+    assert again == out_key
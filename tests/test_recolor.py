@@ -0,0 +1,45 @@
+"""
+Local recolor keeps the lightness structure (folds, shading) inside the
+recolored region, including shifts towards black or white.
+"""
+
+import numpy as np
+import pytest
+
+from modules.recolor import recolor, resolve_color
+
+
+def gray_ramp(lo, hi, steps=5, band=20):
+    """Horizontal bands of gray from lo to hi (a fold / shading ramp)."""
+    levels = np.linspace(lo, hi, steps).round().astype(np.uint8)
+    return np.repeat(levels, band)[:, None, None].repeat(40, 1).repeat(3, 2)
+
+
+def band_means(image_bgr, steps=5, band=20):
+    gray = image_bgr.astype(np.float32).mean(2)
+    return np.array([gray[i * band + 5:(i + 1) * band - 5].mean() for i in range(steps)])
+
+
+@pytest.mark.parametrize("lo, hi, source, target", [
+    (20, 60, "Black", "White"),
+    (200, 250, "White", "Navy"),
+    (90, 160, "Gray", "Red"),
+])
+def test_contrast_survives(lo, hi, source, target):
+    image = gray_ramp(lo, hi)
+    out, alpha = recolor(image, resolve_color(source), resolve_color(target))
+
+    assert alpha.min() > 0  # whole ramp is in the region
+    before = band_means(image)
+    after = band_means(out)
+
+    # Same ordering, no flattened bands, and at least a third of the
+    # original spread left
+    assert np.all(np.diff(after) > 1.0), after
+    assert after[-1] - after[0] >= (before[-1] - before[0]) / 3, after
+
+
+def test_target_lightness_reached():
+    image = gray_ramp(20, 60)
+    out, _ = recolor(image, resolve_color("Black"), resolve_color("White"))
+    assert band_means(out).mean() > 200
@@ -0,0 +1,46 @@
+"""
+Two ResultCache instances on one index file stand in for two gunicorn
+workers: entries written by one must be served by the other, and
+eviction must never delete output files.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.storage import Storage, LocalBackend  # noqa: E402
+from modules.result_cache import ResultCache  # noqa: E402
+
+
+def make(tmp_path, max_bytes=1 << 20):
+    storage = Storage(LocalBackend(str(tmp_path / "output"), "/static/output/"))
+    index = str(tmp_path / "cache" / "index.json")
+    return storage, index, max_bytes
+
+
+def test_entries_from_other_workers_are_served(tmp_path):
+    storage, index, max_bytes = make(tmp_path)
+    a = ResultCache(storage, index, max_bytes, ttl=3600)
+    b = ResultCache(storage, index, max_bytes, ttl=3600)
+
+    ka = storage.save(b"a" * 10, "out", ".png")
+    kb = storage.save(b"b" * 10, "out", ".png")
+    a.put("ka", ka)
+    b.put("kb", kb)
+
+    assert a.get("kb") == kb
+    assert b.get("ka") == ka
+    assert a.get("missing") is None
+
+
+def test_eviction_keeps_output_files(tmp_path):
+    storage, index, _ = make(tmp_path)
+    cache = ResultCache(storage, index, max_bytes=150, ttl=3600)
+
+    keys = [storage.save(bytes([i]) * 100, "out", ".png") for i in range(3)]
+    for i, key in enumerate(keys):
+        cache.put(f"k{i}", key)
+
+    assert cache.stats()["entries"] == 1
+    assert all(storage.exists(key) for key in keys)
@@ -0,0 +1,38 @@
+"""
+Pinning: keys a job writes, reads or checks inside pin_scope() are held
+until the scope exits, so the janitor skips them.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.storage import Storage, LocalBackend, pin_scope  # noqa: E402
+
+
+def test_reads_inside_pin_scope_are_pinned(tmp_path):
+    storage = Storage(LocalBackend(str(tmp_path / "output"), "/static/output/"))
+    upload = storage.save(b"upload", "multicolor", ".jpg")
+    analysis = storage.save(b"{}", "multicolor_colors", ".json")
+    assert not storage.is_pinned(upload)
+
+    with pin_scope():
+        storage.read(upload)
+        storage.read(upload)
+        storage.exists(analysis)
+        out = storage.save(b"result", "final", ".png")
+        assert storage.is_pinned(upload)
+        assert storage.is_pinned(analysis)
+        assert storage.is_pinned(out)
+
+    assert not any(storage.is_pinned(k) for k in (upload, analysis, out))
+
+
+def test_pinned_outside_scope(tmp_path):
+    storage = Storage(LocalBackend(str(tmp_path / "tmp"), "/static/tmp/"))
+    key = storage.save(b"setup", "setup", ".png")
+
+    with storage.pinned(key):
+        assert storage.is_pinned(key)
+    assert not storage.is_pinned(key)